@@ -1,374 +1,539 @@
 import os
+import json
 import pandas as pd
 import numpy as np
-import logging
 from datetime import datetime
+from time import perf_counter
 from multiprocessing import Pool
-import xgrads
-from netCDF4 import date2num
-import warnings
-import xarray as xr
+from gradsio import opengrads, readctl
+from netCDF4 import Dataset, date2num
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+try:
+    import numba
+except ImportError:
+    numba = None
 
-def grads2netcdf(baserun:datetime, ctl:str):
-    print("======================================================================")
-    print(f"GrADS to NetCDF Converter | modelcycle {baserun} | domain {ctl} ...")
-    print("======================================================================")
-    cwd = os.getcwd()
-    ctlf = cwd+"/"+ctl+".ctl"
-    print(f"Reading {ctlf} ...")
-    netcdf = baserun.strftime(f"/home/model-admin/ofs-prod/inawaves/post/w3g_{ctl}_%Y%m%d_%H00.nc")
-    # netcdf = baserun.strftime(f"/data/ofs/output/nc/inawaves/%Y/%m/w3g_{ctl}_%Y%m%d_%H00.nc")
-    if not os.path.exists(os.path.dirname(netcdf)):
-        os.makedirs(os.path.dirname(netcdf))
-    dset = xgrads.open_CtlDataset(ctlf)
-    hs = dset.hs.compute().data.astype(float)
-    hs[hs < 0] = np.nan
-    hs = (hs*0.7084*1.1)+0.261
-    hmax = hs.astype(float) * 2.0
-    dirc = np.rad2deg(dset.dir.compute()).data.astype(float)
-    dirc[dirc < -360] = np.nan
-    dp = np.rad2deg(dset.dp.compute()).data.astype(float)
-    dp[dp < -360] = np.nan
-    uwnd = dset.uwnd.compute().data.astype(float) * 1.943844492457
-    uwnd[uwnd < -100] = np.nan
-    vwnd = dset.vwnd.compute().data.astype(float) * 1.943844492457
-    vwnd[vwnd < -100] = np.nan
-    lm = dset.lm.compute().data.astype(float)
-    lm[lm < 0] = np.nan
-    t01 = dset.t01.compute().data.astype(float)
-    t01[t01 < 0] = np.nan
-    phs00 = dset.phs00.compute().data.astype(float)
-    phs00[phs00 < 0] = np.nan
-    phs01 = dset.phs01.compute().data.astype(float)
-    phs01[phs01 < 0] = np.nan
-    phs02 = dset.phs02.compute().data.astype(float)
-    phs02[phs02 < 0] = np.nan
-    ptp00 = dset.ptp00.compute().data.astype(float)
-    ptp00[ptp00 < 0] = np.nan
-    ptp01 = dset.ptp01.compute().data.astype(float)
-    ptp01[ptp01 < 0] = np.nan
-    ptp02 = dset.ptp02.compute().data.astype(float)
-    ptp02[ptp02 < 0] = np.nan
-    pdi00 = np.rad2deg(dset.pdi00.compute().data.astype(float))
-    pdi00[pdi00 < -360] = np.nan
-    pdi01 = np.rad2deg(dset.pdi01.compute().data.astype(float))
-    pdi01[pdi01 < -360] = np.nan
-    pdi02 = np.rad2deg(dset.pdi02.compute().data.astype(float))
-    pdi02[pdi02 < -360] = np.nan
-    t_unit = baserun.strftime("minute since %Y-%m-%d %H:00")
-    t_calendar = "gregorian"
-    dft = pd.to_datetime(dset.time.dt.strftime("%Y%m%d%H%M"))
-    time = xr.DataArray(
-        data = date2num(list(dft), units=t_unit, calendar=t_calendar),
-        dims = ['time']
-        ).astype(dtype=np.int32)
-
-    dset = xr.Dataset(data_vars = {
-        'hs' : xr.DataArray(
-            data = hs,
-            dims = ['time','lat','lon'],
-            coords = {
-                "time": time,
-                "lat" : dset.lat.data,
-                "lon" : dset.lon.data
-            }
-        ),
-        'hmax' : xr.DataArray(
-            data = hmax,
-            dims = ['time','lat','lon'],
-            coords = {
-                "time": time,
-                "lat" : dset.lat.data,
-                "lon" : dset.lon.data
-            }
-        ),
-        'dir' : xr.DataArray(
-            data = dirc,
-            dims = ['time','lat','lon'],
-            coords = {
-                "time": time,
-                "lat" : dset.lat.data,
-                "lon" : dset.lon.data
-            }
-        ),
-        'dp' : xr.DataArray(
-            data = dp,
-            dims = ['time','lat','lon'],
-            coords = {
-                "time": time,
-                "lat" : dset.lat.data,
-                "lon" : dset.lon.data
-            }
-        ),
-        'lm' : xr.DataArray(
-            data = lm,
-            dims = ['time','lat','lon'],
-            coords = {
-                "time": time,
-                "lat" : dset.lat.data,
-                "lon" : dset.lon.data
-            }
-        ),
-        't01' : xr.DataArray(
-            data = t01,
-            dims = ['time','lat','lon'],
-            coords = {
-                "time": time,
-                "lat" : dset.lat.data,
-                "lon" : dset.lon.data
-            }
-        ),
-        'uwnd' : xr.DataArray(
-            data = uwnd,
-            dims = ['time','lat','lon'],
-            coords = {
-                "time": time,
-                "lat" : dset.lat.data,
-                "lon" : dset.lon.data
-            }
-        ),
-        'vwnd' : xr.DataArray(
-            data = vwnd,
-            dims = ['time','lat','lon'],
-            coords = {
-                "time": time,
-                "lat" : dset.lat.data,
-                "lon" : dset.lon.data
-            }
-        ),
-        'phs00' : xr.DataArray(
-            data = phs00,
-            dims = ['time','lat','lon'],
-            coords = {
-                "time": time,
-                "lat" : dset.lat.data,
-                "lon" : dset.lon.data
-            }
-        ),
-        'phs01' : xr.DataArray(
-            data = phs01,
-            dims = ['time','lat','lon'],
-            coords = {
-                "time": time,
-                "lat" : dset.lat.data,
-                "lon" : dset.lon.data
-            }
-        ),
-        'phs02' : xr.DataArray(
-            data = phs02,
-            dims = ['time','lat','lon'],
-            coords = {
-                "time": time,
-                "lat" : dset.lat.data,
-                "lon" : dset.lon.data
-            }
-        ),
-        'ptp00' : xr.DataArray(
-            data = ptp00,
-            dims = ['time','lat','lon'],
-            coords = {
-                "time": time,
-                "lat" : dset.lat.data,
-                "lon" : dset.lon.data
-            }
-        ),
-        'ptp01' : xr.DataArray(
-            data = ptp01,
-            dims = ['time','lat','lon'],
-            coords = {
-                "time": time,
-                "lat" : dset.lat.data,
-                "lon" : dset.lon.data
-            }
-        ),
-        'ptp02' : xr.DataArray(
-            data = ptp02,
-            dims = ['time','lat','lon'],
-            coords = {
-                "time": time,
-                "lat" : dset.lat.data,
-                "lon" : dset.lon.data
-            }
-        ),
-            'ptp02' : xr.DataArray(
-            data = ptp02,
-            dims = ['time','lat','lon'],
-            coords = {
-                "time": time,
-                "lat" : dset.lat.data,
-                "lon" : dset.lon.data
-            }
-        ),    
-        'pdi00' : xr.DataArray(
-            data = pdi00,
-            dims = ['time','lat','lon'],
-            coords = {
-                "time": time,
-                "lat" : dset.lat.data,
-                "lon" : dset.lon.data
-            }
-        ),    
-        'pdi01' : xr.DataArray(
-            data = pdi01,
-            dims = ['time','lat','lon'],
-            coords = {
-                "time": time,
-                "lat" : dset.lat.data,
-                "lon" : dset.lon.data
-            }
-        ),
-        'pdi02' : xr.DataArray(
-            data = ptp02,
-            dims = ['time','lat','lon'],
-            coords = {
-                "time": time,
-                "lat" : dset.lat.data,
-                "lon" : dset.lon.data
-            }
-        ),
-    })
-
-    dset.lat.attrs = {
-        "long_name" : "Latitude", 
-        "standard_name" : "latitude", 
-        "units" : "degrees_north"
-    }
-    dset.lon.attrs = {
-        "long_name" : "Longitude", 
-        "standard_name" : "longitude", 
-        "units" : "degrees_east"
-    }
-    dset.time.attrs = {
-        "long_name" : "Time", 
-        "standard_name" : "time",
-        "units": t_unit,
-        "calendar": t_calendar 
-    }
-    dset.hs.attrs = {
-        "long_name" : "Significant wave height", 
+# time steps read, corrected and written at once, bounds the peak memory
+tchunk = 24
+
+# output variables in file order with their CF attributes
+varattrs = {
+    "hs" : {
+        "long_name" : "Significant wave height",
         "standard_name" : "sea_surface_wave_significant_height",
         "units":"m"
-    }
-    dset.lm.attrs = {
-        "long_name" : "Wave Length", 
-        "standard_name" : "sea_surface_wave_mean_wavelength_from_variance_spectral_density_inverse_wavenumber_moment", 
+    },
+    "hmax" : {
+        "long_name" : "Maximum Wave Height",
+        "standard_name" : "sea_surface_wave_maximum_height",
         "units" : "m"
-    }
-    dset.t01.attrs = {
-        "long_name" : "Wave Period", 
-        "standard_name" : "sea_surface_wave_significant_period", 
-        "units" : "s"
-    }
-    dset.dir.attrs = {
-        "long_name" : "Mean Wave Direction", 
-        "standard_name" : "sea_surface_mean_wave_from_direction", 
+    },
+    "dir" : {
+        "long_name" : "Mean Wave Direction",
+        "standard_name" : "sea_surface_mean_wave_from_direction",
         "units" : "degree"
-    }
-    dset.dp.attrs = {
-        "long_name" : "Peak Wave Direction", 
-        "standard_name" : "sea_surface_peak_wave_from_direction", 
+    },
+    "dp" : {
+        "long_name" : "Peak Wave Direction",
+        "standard_name" : "sea_surface_peak_wave_from_direction",
         "units" : "degree"
-    }
-    dset.phs00.attrs = {
-        "long_name" : "Wind Sea Height", 
-        "standard_name" : "sea_surface_wind_wave_significant_height", 
+    },
+    "lm" : {
+        "long_name" : "Wave Length",
+        "standard_name" : "sea_surface_wave_mean_wavelength_from_variance_spectral_density_inverse_wavenumber_moment",
+        "units" : "m"
+    },
+    "t01" : {
+        "long_name" : "Wave Period",
+        "standard_name" : "sea_surface_wave_significant_period",
+        "units" : "s"
+    },
+    "uwnd" : {
+        "long_name" : "Eastward Wind Speed",
+        "standard_name" : "eastward_wind",
+        "units" : "knot"
+    },
+    "vwnd" : {
+        "long_name" : "Northward Wind",
+        "standard_name" : "northward_wind",
+        "units" : "knot"
+    },
+    "phs00" : {
+        "long_name" : "Wind Sea Height",
+        "standard_name" : "sea_surface_wind_wave_significant_height",
         "units":"m"
-    }
-    dset.phs01.attrs = {
-        "long_name" : "Primary Swell Height", 
-        "standard_name" : "sea_surface_primary_swell_wave_significant_height", 
+    },
+    "phs01" : {
+        "long_name" : "Primary Swell Height",
+        "standard_name" : "sea_surface_primary_swell_wave_significant_height",
         "units" : "m"
-    }
-    dset.phs02.attrs = {
-        "long_name" : "Secondary Swell Height", 
-        "standard_name" : "sea_surface_secondary_swell_wave_significant_height", 
+    },
+    "phs02" : {
+        "long_name" : "Secondary Swell Height",
+        "standard_name" : "sea_surface_secondary_swell_wave_significant_height",
         "units" : "m"
-    }
-    dset.ptp00.attrs = {
-        "long_name" : "Wind Sea Period", 
-        "standard_name" : "sea_surface_wind_wave_period", 
+    },
+    "ptp00" : {
+        "long_name" : "Wind Sea Period",
+        "standard_name" : "sea_surface_wind_wave_period",
         "units" : "s"
-    }
-    dset.ptp01.attrs = {
-        "long_name" : "Primary Swell Period", 
-        "standard_name" : "sea_surface_primary_swell_wave_mean_period", 
+    },
+    "ptp01" : {
+        "long_name" : "Primary Swell Period",
+        "standard_name" : "sea_surface_primary_swell_wave_mean_period",
         "units" : "s"
-    }
-    dset.ptp02.attrs = {
-        "long_name" : "Secondary Swell Period", 
-        "standard_name" : "sea_surface_secondary_swell_wave_mean_period", 
+    },
+    "ptp02" : {
+        "long_name" : "Secondary Swell Period",
+        "standard_name" : "sea_surface_secondary_swell_wave_mean_period",
         "units" : "s"
-    }
-    dset.pdi00.attrs = {
-        "long_name" : "Wind Sea Direction", 
-        "standard_name" : "sea_surface_wind_wave_from_direction", 
+    },
+    "pdi00" : {
+        "long_name" : "Wind Sea Direction",
+        "standard_name" : "sea_surface_wind_wave_from_direction",
         "units" : "degree"
-    }
-    dset.pdi01.attrs = {
-        "long_name" : "Primary Swell Direction", 
-        "standard_name" : "sea_surface_primary_swell_wave_from_direction", 
+    },
+    "pdi01" : {
+        "long_name" : "Primary Swell Direction",
+        "standard_name" : "sea_surface_primary_swell_wave_from_direction",
         "units" : "degree"
-    }
-    dset.pdi02.attrs = {
-        "long_name" : "Secondary Swell Direction", 
-        "standard_name" : "sea_surface_secondary_swell_wave_from_direction", 
+    },
+    "pdi02" : {
+        "long_name" : "Secondary Swell Direction",
+        "standard_name" : "sea_surface_secondary_swell_wave_from_direction",
         "units" : "degree"
-    }
-    dset.uwnd.attrs = {
-        "long_name" : "Eastward Wind Speed", 
-        "standard_name" : "eastward_wind", 
-        "units" : "knot"
-    }
-    dset.vwnd.attrs = {
-        "long_name" : "Northward Wind", 
-        "standard_name" : "northward_wind", 
+    },
+}
+
+globalattrs = {
+    "source": "Inawaves - BMKG Ocean Forecast System (OFS)",
+    "description": "Inawaves Model - Forecast",
+    "institution": "BMKG - Center For Marine Meteorology",
+    "email": "produksi.maritim@bmkg.go.id",
+    "Conventions" : "CF-1.8"
+}
+
+ms2kt = 1.943844492457
+rad2deg = 180/np.pi
+
+# correction of every output variable, in file order : out = src*scale + offset
+# where the GrADS value src >= lowest, NaN elsewhere (land) and at the UNDEF
+# value of the .ctl, wrapped into [0, period) unless period is None
+#   output : (GrADS variable, scale, offset, lowest, period)
+transforms = {
+    "hs" : ("hs", 0.7084*1.1, 0.261, 0., None),           # bias correction
+    "hmax" : ("hs", 2*0.7084*1.1, 2*0.261, 0., None),     # twice the corrected hs
+    "dir" : ("dir", rad2deg, 0., -360/rad2deg, None),     # radian to degree
+    "dp" : ("dp", rad2deg, 0., -360/rad2deg, None),
+    "lm" : ("lm", 1., 0., 0., None),
+    "t01" : ("t01", 1., 0., 0., None),
+    "uwnd" : ("uwnd", ms2kt, 0., -100/ms2kt, None),       # m/s to knot
+    "vwnd" : ("vwnd", ms2kt, 0., -100/ms2kt, None),
+    "phs00" : ("phs00", 1., 0., 0., None),
+    "phs01" : ("phs01", 1., 0., 0., None),
+    "phs02" : ("phs02", 1., 0., 0., None),
+    "ptp00" : ("ptp00", 1., 0., 0., None),
+    "ptp01" : ("ptp01", 1., 0., 0., None),
+    "ptp02" : ("ptp02", 1., 0., 0., None),
+    "pdi00" : ("pdi00", rad2deg, 0., -360/rad2deg, None),
+    "pdi01" : ("pdi01", rad2deg, 0., -360/rad2deg, None),
+    "pdi02" : ("pdi02", rad2deg, 0., -360/rad2deg, None),
+}
+
+def _cosd(d):
+    return np.cos(np.deg2rad(d))
+
+def _sind(d):
+    return np.sin(np.deg2rad(d))
+
+# optional derived variables, computed once per time chunk from the corrected
+# output variables (or earlier derived ones) and written after them
+#   output : (function, input variables)
+# wind speed, unit vectors of the wind and of the directions plotter.py draws
+# as arrows. Zero wind gives NaN vectors, as in the plotter
+derivations = {
+    "ws" : (np.hypot, ("uwnd", "vwnd")),
+    "wnd_u" : (np.divide, ("uwnd", "ws")),
+    "wnd_v" : (np.divide, ("vwnd", "ws")),
+    "dir_u" : (_cosd, ("dir",)),
+    "dir_v" : (_sind, ("dir",)),
+    "pdi00_u" : (_cosd, ("pdi00",)),
+    "pdi00_v" : (_sind, ("pdi00",)),
+    "pdi01_u" : (_cosd, ("pdi01",)),
+    "pdi01_v" : (_sind, ("pdi01",)),
+}
+
+derivedattrs = {
+    "ws" : {
+        "long_name" : "Wind Speed",
+        "standard_name" : "wind_speed",
         "units" : "knot"
-    }
-    dset.hmax.attrs = {
-        "long_name" : "Maximum Wave Height", 
-        "standard_name" : "sea_surface_wave_maximum_height", 
-        "units" : "m"
-    }
-    dset.attrs = {
-        "source": "Inawaves - BMKG Ocean Forecast System (OFS)",
-        "description": "Inawaves Model - Forecast",
-        "institution": "BMKG - Center For Marine Meteorology",
-        "email": "produksi.maritim@bmkg.go.id",
-        "Conventions" : "CF-1.8"
-    }
-    dset.to_netcdf(netcdf, encoding={
-        "hs" : {"dtype":"float64", "zlib":"true", "least_significant_digit":3, "complevel":5},
-        "hmax" : {"dtype":"float64", "zlib":"true", "least_significant_digit":3, "complevel":5},
-        "dir" : {"dtype":"float64", "zlib":"true", "least_significant_digit":3, "complevel":5},
-        "dp" : {"dtype":"float64", "zlib":"true", "least_significant_digit":3, "complevel":5},
-        "lm" : {"dtype":"float64", "zlib":"true", "least_significant_digit":3, "complevel":5},
-        "t01" : {"dtype":"float64", "zlib":"true", "least_significant_digit":3, "complevel":5},
-        "uwnd" : {"dtype":"float64", "zlib":"true", "least_significant_digit":3, "complevel":5},
-        "vwnd" : {"dtype":"float64", "zlib":"true", "least_significant_digit":3, "complevel":5},
-        "phs00" : {"dtype":"float64", "zlib":"true", "least_significant_digit":3, "complevel":5},
-        "phs01" : {"dtype":"float64", "zlib":"true", "least_significant_digit":3, "complevel":5},
-        "phs02" : {"dtype":"float64", "zlib":"true", "least_significant_digit":3, "complevel":5},
-        "ptp00" : {"dtype":"float64", "zlib":"true", "least_significant_digit":3, "complevel":5},
-        "ptp01" : {"dtype":"float64", "zlib":"true", "least_significant_digit":3, "complevel":5},
-        "ptp02" : {"dtype":"float64", "zlib":"true", "least_significant_digit":3, "complevel":5},
-        "ptp02" : {"dtype":"float64", "zlib":"true", "least_significant_digit":3, "complevel":5},
-        "pdi00" : {"dtype":"float64", "zlib":"true", "least_significant_digit":3, "complevel":5},
-        "pdi01" : {"dtype":"float64", "zlib":"true", "least_significant_digit":3, "complevel":5},
-        "pdi02" : {"dtype":"float64", "zlib":"true", "least_significant_digit":3, "complevel":5},
-    }, format="NETCDF4_CLASSIC")
+    },
+    "wnd_u" : {"long_name" : "Eastward Component of the Wind Unit Vector", "units" : "1"},
+    "wnd_v" : {"long_name" : "Northward Component of the Wind Unit Vector", "units" : "1"},
+    "dir_u" : {"long_name" : "Cosine of the Mean Wave Direction", "units" : "1"},
+    "dir_v" : {"long_name" : "Sine of the Mean Wave Direction", "units" : "1"},
+    "pdi00_u" : {"long_name" : "Cosine of the Wind Sea Direction", "units" : "1"},
+    "pdi00_v" : {"long_name" : "Sine of the Wind Sea Direction", "units" : "1"},
+    "pdi01_u" : {"long_name" : "Cosine of the Primary Swell Direction", "units" : "1"},
+    "pdi01_v" : {"long_name" : "Sine of the Primary Swell Direction", "units" : "1"},
+}
+
+# compression of the data variables, zlib5 is the original setting
+codecs = {
+    "zlib5" : {"compression": "zlib", "complevel": 5, "shuffle": True},
+    "zlib1" : {"compression": "zlib", "complevel": 1, "shuffle": True},
+    "zstd"  : {"compression": "zstd", "complevel": 3, "shuffle": True},
+    "none"  : {"compression": None},
+}
+codec = "zlib5"
+
+# chunk shape (time, lat, lon) of the data variables from the dimension sizes
+#   default : netCDF library choice
+#   map     : one whole field per chunk, for per-timestep maps (plotter.py)
+#   series  : long time runs of small tiles, for point time series
+seriessteps, seriestile = 96, 32
+chunkings = {
+    "default" : lambda nt, ny, nx: None,
+    "map"     : lambda nt, ny, nx: (1, ny, nx),
+    "series"  : lambda nt, ny, nx: (min(nt, seriessteps), min(ny, seriestile), min(nx, seriestile)),
+}
+chunking = "default"
+
+# output profiles : on-disk type of the data variables
+#   float64 : the original layout
+#   float32 : WW3 works in single precision, half the size at no loss
+#   int16   : CF packed with per-variable scale_factor/add_offset over packrange
+profiles = {
+    "float64" : {"dtype": "f8", "fill": np.nan, "least_significant_digit": 3},
+    "float32" : {"dtype": "f4", "fill": np.float32(np.nan), "least_significant_digit": 3},
+    "int16"   : {"dtype": "i2", "fill": np.int16(-32767)},
+}
+profile = "float64"
+
+# physical range of each variable packed by the int16 profile, values
+# outside are clipped. Resolution is (max-min)/65532, e.g. 0.5 mm for hs
+packrange = {
+    "hs" : (0., 30.),
+    "hmax" : (0., 60.),
+    "dir" : (-360., 360.),
+    "dp" : (-360., 360.),
+    "lm" : (0., 2000.),
+    "t01" : (0., 40.),
+    "uwnd" : (-200., 200.),
+    "vwnd" : (-200., 200.),
+    "phs00" : (0., 30.),
+    "phs01" : (0., 30.),
+    "phs02" : (0., 30.),
+    "ptp00" : (0., 40.),
+    "ptp01" : (0., 40.),
+    "ptp02" : (0., 40.),
+    "pdi00" : (-360., 360.),
+    "pdi01" : (-360., 360.),
+    "pdi02" : (-360., 360.),
+    "ws" : (0., 200.),
+    "wnd_u" : (-1., 1.),
+    "wnd_v" : (-1., 1.),
+    "dir_u" : (-1., 1.),
+    "dir_v" : (-1., 1.),
+    "pdi00_u" : (-1., 1.),
+    "pdi00_v" : (-1., 1.),
+    "pdi01_u" : (-1., 1.),
+    "pdi01_v" : (-1., 1.),
+}
+
+def packing(var:str) -> dict:
+    # CF scale_factor/add_offset mapping packrange onto -32766..32766
+    vmin, vmax = packrange[var]
+    return {"scale_factor": np.float32((vmax-vmin)/65532.),
+            "add_offset": np.float32((vmax+vmin)/2.)}
+
+def _transform_numpy(src, scale:float, offset:float, lowest:float, undef, out):
+    np.multiply(src, scale, out=out)
+    out += offset
+    np.copyto(out, np.nan, where=src < lowest)
+    np.copyto(out, np.nan, where=src == undef)
+
+def _transform_numexpr(src, scale:float, offset:float, lowest:float, undef, out):
+    numexpr.evaluate("where((src >= lowest) & (src != undef), src*scale + offset, nan)",
+                     out=out, casting="unsafe",
+                     local_dict={"src": src, "scale": scale, "offset": offset, "lowest": lowest,
+                                 "undef": undef, "nan": np.nan})
+
+if numba is not None:
+    @numba.njit(parallel=True, cache=True)
+    def _transform_numba(src, scale, offset, lowest, undef, out):
+        nt, ny, nx = src.shape
+        for t in numba.prange(nt):
+            for j in range(ny):
+                for i in range(nx):
+                    x = src[t, j, i]
+                    out[t, j, i] = x*scale + offset if x >= lowest and x != undef else np.nan
+
+# one pass over the GrADS values per variable, compiled and threaded when available
+if numba is not None:
+    kernel, transform = "numba", _transform_numba
+elif numexpr is not None:
+    kernel, transform = "numexpr", _transform_numexpr
+else:
+    kernel, transform = "numpy", _transform_numpy
+# numba only types native byte order, OPTIONS big_endian data is memory-mapped as >f4
+swapped = _transform_numexpr if numexpr is not None else _transform_numpy
+
+def loadtransforms(fjson:str) -> dict:
+    # transforms table with the entries of a JSON file {output: [source, scale, offset, lowest(, period)]}
+    with open(fjson) as f:
+        override = json.load(f)
+    table = dict(transforms)
+    for var, (src, scale, offset, lowest, *period) in override.items():
+        if var not in varattrs:
+            raise ValueError(f"{fjson}: unknown output variable {var}")
+        period = period[0] if period else None
+        table[var] = (src, float(scale), float(offset), float(lowest),
+                      None if period is None else float(period))
+    return table
+
+def gradschunk(fields:dict, tsl:slice, transforms:dict=transforms, undef:float=None):
+    """
+    Read time steps tsl of the memory-mapped GrADS fields and yield every
+    output variable corrected by its transforms entry, NaN where the source
+    holds undef whatever lowest is. All variables are computed into the same
+    float64 buffer, valid until the next one is yielded.
+    """
+    out = None
+    for var, (src, scale, offset, lowest, period) in transforms.items():
+        data = fields[src][tsl]
+        if out is None:
+            out = np.empty(data.shape)
+        # compared in the precision of the data, -999.9 is not exact in float32;
+        # NaN never compares equal, nothing is masked without undef
+        nodata = data.dtype.type(np.nan if undef is None else undef)
+        (transform if data.dtype.isnative else swapped)(data, scale, offset, lowest, nodata, out)
+        if period is not None:
+            np.mod(out, period, out=out)
+        yield var, out
+
+def createnetcdf(netcdf:str, time, t_unit:str, t_calendar:str, lat, lon, profile:str=profile,
+                 chunking:str=chunking, codec:str=codec, unlimited:bool=False, derived:dict=None):
+    # empty output file with the full schema, data variables filled later. An
+    # unlimited time axis starts empty and grows as steps are written, time
+    # then only gives the expected length for the chunk shape. The derived
+    # variables come after the corrected ones
+    prof = profiles[profile]
+    chunksizes = chunkings[chunking](len(time), len(lat), len(lon))
+    nc = Dataset(netcdf, "w", format="NETCDF4_CLASSIC")
+    nc.createDimension("time", None if unlimited else len(time))
+    nc.createDimension("lat", len(lat))
+    nc.createDimension("lon", len(lon))
+    for name, data, attrs in [
+        ("time", time, {"long_name" : "Time", "standard_name" : "time", "units": t_unit, "calendar": t_calendar}),
+        ("lat", lat, {"long_name" : "Latitude", "standard_name" : "latitude", "units" : "degrees_north"}),
+        ("lon", lon, {"long_name" : "Longitude", "standard_name" : "longitude", "units" : "degrees_east"}),
+    ]:
+        var = nc.createVariable(name, data.dtype, (name,),
+                                fill_value=np.nan if data.dtype.kind == "f" else None)
+        var.setncatts(attrs)
+        if not (unlimited and name == "time"):
+            var[:] = data
+    for name, attrs in {**varattrs, **{d: derivedattrs[d] for d in derived or {}}}.items():
+        var = nc.createVariable(name, prof["dtype"], ("time", "lat", "lon"), fill_value=prof["fill"],
+                                least_significant_digit=prof.get("least_significant_digit"),
+                                chunksizes=chunksizes, **codecs[codec])
+        # room for one chunk only, chunks are written whole and go straight to disk
+        if var.chunking() != "contiguous":
+            var.set_var_chunk_cache(size=int(np.prod(var.chunking()))*var.dtype.itemsize)
+        var.setncatts(attrs)
+        if prof["dtype"] == "i2":
+            # netCDF4 packs on write and readers unpack to float32
+            var.setncatts(packing(name))
+    nc.setncatts(globalattrs)
+    return nc
+
+def _writevar(nc:Dataset, var:str, data, out:slice, profile:str):
+    # write data to time steps out of var, data may be modified
+    if profile == "int16":
+        nan = np.isnan(data)
+        np.clip(data, *packrange[var], out=data)
+        data[nan] = 0
+        data = np.ma.array(data, mask=nan)
+    nc[var][out] = data
+
+def derive(values:dict, derived:dict=derivations) -> dict:
+    # derived variables from values {output variable: array}, vectorized over the whole chunk
+    values = dict(values)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for var, (func, inputs) in derived.items():
+            values[var] = func(*(values[v] for v in inputs))
+    return {var: values[var] for var in derived}
+
+def writesteps(nc:Dataset, fields:dict, tsl:slice, t0:int=None, profile:str=profile,
+               transforms:dict=transforms, derived:dict=None, undef:float=None):
+    # correct time steps tsl of fields and write them from time index t0 on (default tsl.start),
+    # then their derived variables
+    t0 = tsl.start if t0 is None else t0
+    out = slice(t0, t0 + tsl.stop - tsl.start)
+    inputs = {v for _, vs in (derived or {}).values() for v in vs}
+    kept = {}
+    for var, data in gradschunk(fields, tsl, transforms, undef):
+        if var in inputs:
+            kept[var] = data.copy()
+        _writevar(nc, var, data, out, profile)
+    if derived:
+        for var, data in derive(kept, derived).items():
+            _writevar(nc, var, data, out, profile)
+
+def writenetcdf(netcdf:str, fields:dict, timeenc:tuple, lat, lon, tchunk:int=tchunk, profile:str=profile,
+                chunking:str=chunking, codec:str=codec, transforms:dict=transforms, derived:dict=None,
+                undef:float=None):
+    """
+    Write the corrected fields to a new file. fields maps the source names of
+    transforms to arrays (time, lat, lon) that are only read one slice at a time,
+    undef is their missing value if any.
+    """
+    # only one chunk of one variable is held in memory at a time, the chunk
+    # is rounded to whole NetCDF time chunks so none is compressed twice
+    time, t_unit, t_calendar = timeenc
+    nt = len(time)
+    with createnetcdf(netcdf, time, t_unit, t_calendar, lat, lon, profile, chunking, codec,
+                      derived=derived) as nc:
+        ncchunk = 1 if nc["hs"].chunking() == "contiguous" else nc["hs"].chunking()[0]
+        tchunk = -(-tchunk//ncchunk)*ncchunk
+        for t0 in range(0, nt, tchunk):
+            tsl = slice(t0, min(t0+tchunk, nt))
+            writesteps(nc, fields, tsl, profile=profile, transforms=transforms, derived=derived, undef=undef)
+            print(f"  steps {tsl.start+1}-{tsl.stop} of {nt} written")
+
+def defaultnetcdf(baserun:datetime, domain:str) -> str:
+    # production NetCDF file of a domain, shared by every converter
+    # return baserun.strftime(f"/data/ofs/output/nc/inawaves/%Y/%m/w3g_{domain}_%Y%m%d_%H00.nc")
+    return baserun.strftime(f"/home/model-admin/ofs-prod/inawaves/post/w3g_{domain}_%Y%m%d_%H00.nc")
+
+def linkdomain(domain:str, work:str="."):
+    # point the fixed mod_def.ww3/out_grd.ww3 names the WW3 tools read in work
+    # at mod_def.<domain>/out_grd.<domain> of the current directory
+    for link, target in [("mod_def.ww3", f"mod_def.{domain}"), ("out_grd.ww3", f"out_grd.{domain}")]:
+        link = os.path.join(work, link)
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(os.path.relpath(target, work), link)
+
+def timeaxis(baserun:datetime, times) -> tuple:
+    # CF time coordinate (int32 minutes since the model cycle), units and calendar
+    t_unit = baserun.strftime("minute since %Y-%m-%d %H:00")
+    t_calendar = "gregorian"
+    dft = pd.to_datetime(times)
+    time = date2num(list(dft), units=t_unit, calendar=t_calendar).astype(np.int32)
+    return time, t_unit, t_calendar
+
+def grads2netcdf(baserun:datetime, ctl:str, tchunk:int=tchunk, profile:str=profile,
+                 chunking:str=chunking, codec:str=codec, netcdf:str=None, transforms:dict=transforms,
+                 timeenc:tuple=None, derived:dict=None):
+    print("======================================================================")
+    print(f"GrADS to NetCDF Converter | modelcycle {baserun} | domain {ctl} ...")
+    print("======================================================================")
+    cwd = os.getcwd()
+    ctlf = cwd+"/"+ctl+".ctl"
+    print(f"Reading {ctlf} ... output profile {profile}, chunking {chunking}, codec {codec}, {kernel} kernel"
+          + (f", derived {' '.join(derived)}" if derived else ""))
+    if netcdf is None:
+        netcdf = defaultnetcdf(baserun, ctl)
+    if not os.path.exists(os.path.dirname(os.path.abspath(netcdf))):
+        os.makedirs(os.path.dirname(os.path.abspath(netcdf)))
+    ctl, fields = opengrads(ctlf)
+    timeenc = timeenc or timeaxis(baserun, ctl["time"])
+    lat, lon = ctl["lat"].astype(np.float32), ctl["lon"].astype(np.float32)
+    writenetcdf(netcdf, fields, timeenc, lat, lon, tchunk, profile, chunking, codec, transforms, derived,
+                ctl["undef"])
     print(f"File saved at {netcdf}")
+    return netcdf
+
+def footprint(ctlf:str, tchunk:int=tchunk, derived:dict=None) -> int:
+    # rough peak memory of one conversion in bytes : interpreter and libraries
+    # plus about 8 float64 chunks (work buffer, packing copy, chunk caches)
+    # and one per derived variable and per variable they are derived from
+    ctl = readctl(ctlf)
+    nbuf = 8 + len(derived or {}) + len({v for _, vs in (derived or {}).values() for v in vs})
+    return 100*2**20 + nbuf*tchunk*len(ctl["lat"])*len(ctl["lon"])*8
+
+def availmem() -> int:
+    try:
+        with open("/proc/meminfo") as f:
+            for l in f:
+                if l.startswith("MemAvailable:"):
+                    return int(l.split()[1])*1024
+    except OSError:
+        pass
+    return os.sysconf("SC_AVPHYS_PAGES")*os.sysconf("SC_PAGE_SIZE")
+
+def _convert(job):
+    baserun, ctl, timeenc, kwargs = job
+    t = perf_counter()
+    netcdf = grads2netcdf(baserun, ctl, timeenc=timeenc, **kwargs)
+    return ctl, perf_counter() - t, os.path.getsize(netcdf)
+
+def grads2netcdf_domains(baserun:datetime, ctls:list, nproc:int=None, memory:int=None, **kwargs):
+    """
+    Convert several domains from one interpreter. The pool gets one process
+    per domain, capped by the CPUs we may use and by how many of the largest
+    conversion fit in memory (bytes, default what the system has available).
+    The time coordinate is encoded once per distinct time axis.
+    """
+    t = perf_counter()
+    cwd = os.getcwd()
+    ctlfs = {ctl: cwd+"/"+ctl+".ctl" for ctl in ctls}
+    needs = {ctl: footprint(ctlf, kwargs.get("tchunk", tchunk), kwargs.get("derived")) for ctl, ctlf in ctlfs.items()}
+    if nproc is None:
+        ncpu = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+        nproc = max(1, min(len(ctls), ncpu, (memory or availmem())//max(needs.values())))
+
+    timeencs = {}
+    jobs = []
+    # largest domain first so it does not start last
+    for ctl in sorted(ctls, key=needs.get, reverse=True):
+        times = readctl(ctlfs[ctl])["time"]
+        key = times.tobytes()
+        if key not in timeencs:
+            timeencs[key] = timeaxis(baserun, times)
+        jobs.append((baserun, ctl, timeencs[key], kwargs))
+
+    print(f"Converting {', '.join(ctls)} with {nproc} processes, {len(timeencs)} distinct time axes")
+    with Pool(nproc) as pool:
+        done = list(pool.imap_unordered(_convert, jobs))
+
+    print("======================================================================")
+    print(f"{'domain':10s} {'time [s]':>10s} {'size [MB]':>10s} {'memory est. [MB]':>17s}")
+    for ctl, seconds, size in sorted(done, key=lambda d: -d[1]):
+        print(f"{ctl:10s} {seconds:10.1f} {size/2**20:10.1f} {needs[ctl]/2**20:17.0f}")
+    print(f"{'total':10s} {perf_counter() - t:10.1f}")
+    return done
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(
         description="GrADS to NetCDF Converter",
-        epilog="Example:python grads2nc.py 2024102000 hires"
+        epilog="Example:python grads2nc.py hires --modelcycle 2024102000, several domains: python grads2nc.py global reg hires --modelcycle 2024102000"
     )
     parser.add_argument("--modelcycle", type=lambda x: datetime.strptime(x, '%Y%m%d%H'), help="Model cycle -> YYYYMMDDHH. example --modelcycle 2024102000", metavar="modelcycle")
-    parser.add_argument("ctl_file", type=str, help="ctl file. options: hires, reg, global", metavar="ctl_file")
+    parser.add_argument("--tchunk", type=int, default=tchunk, help=f"Time steps converted at once, bounds memory use. default {tchunk}", metavar="tchunk")
+    parser.add_argument("--profile", type=str, default=profile, choices=list(profiles), help=f"Output data type of the variables. default {profile}", metavar="profile")
+    parser.add_argument("--chunking", type=str, default=chunking, choices=list(chunkings), help=f"Chunk layout, map: per-timestep fields, series: point time series. default {chunking}", metavar="chunking")
+    parser.add_argument("--codec", type=str, default=codec, choices=list(codecs), help=f"Compression of the variables. default {codec}", metavar="codec")
+    parser.add_argument("--transforms", type=str, default=None, help="JSON file {variable: [GrADS variable, scale, offset, lowest(, period)]} overriding the built-in corrections", metavar="transforms")
+    parser.add_argument("--derived", action="store_true", help=f"Also store the derived variables {' '.join(derivations)}")
+    parser.add_argument("--nproc", type=int, default=None, help="Processes for several domains. default one per domain within CPU and memory limits", metavar="nproc")
+    parser.add_argument("ctl_file", type=str, nargs="+", help="ctl file(s). options: hires, reg, global", metavar="ctl_file")
     args = parser.parse_args()
 
     print("================")
-    print(f"GRADS CONVERTER")
+    print("GRADS CONVERTER")
     print("================")
-    grads2netcdf(args.modelcycle, args.ctl_file)
\ No newline at end of file
+    table = loadtransforms(args.transforms) if args.transforms else transforms
+    kwargs = dict(tchunk=args.tchunk, profile=args.profile, chunking=args.chunking, codec=args.codec, transforms=table,
+                  derived=derivations if args.derived else None)
+    if len(args.ctl_file) == 1:
+        grads2netcdf(args.modelcycle, args.ctl_file[0], **kwargs)
+    else:
+        grads2netcdf_domains(args.modelcycle, args.ctl_file, args.nproc, **kwargs)
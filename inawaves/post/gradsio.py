@@ -0,0 +1,139 @@
+"""
+Native reader for the GrADS binary written by gx_outf
+
+The .ctl fully describes the flat binary (one 2-D record per variable and
+level, all variables of a time step after each other, optionally wrapped in
+Fortran sequential markers), so every variable is exposed as a numpy.memmap
+view (time, lat, lon) of the file. Nothing is read until a slice is used.
+"""
+import os
+import re
+import numpy as np
+from datetime import datetime
+
+months = ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"]
+# GrADS time increments
+tunits = {"mn": "m", "hr": "h", "dy": "D", "mo": "M", "yr": "Y"}
+
+def gradstime(s:str) -> datetime:
+    # GrADS absolute time, [hh[:mm]Z][dd]mmmyyyy
+    m = re.fullmatch(r"(?:(\d{1,2})(?::(\d{2}))?Z)?(\d{1,2})?([A-Z]{3})(\d{4})", s.upper())
+    if not m:
+        raise ValueError(f"Unsupported GrADS time {s}")
+    hh, mm, dd, mon, yyyy = m.groups()
+    return datetime(int(yyyy), months.index(mon)+1, int(dd or 1), int(hh or 0), int(mm or 0))
+
+def _axis(words:list) -> np.ndarray:
+    # XDEF/YDEF/ZDEF n LINEAR start step | n LEVELS v1 v2 ...
+    n, kind = int(words[0]), words[1].upper()
+    if kind == "LINEAR":
+        return float(words[2]) + float(words[3])*np.arange(n)
+    if kind == "LEVELS":
+        return np.array([float(v) for v in words[2:2+n]])
+    raise ValueError(f"Unsupported axis mapping {kind}")
+
+def _taxis(words:list) -> np.ndarray:
+    # TDEF n LINEAR start increment
+    n = int(words[0])
+    if words[1].upper() != "LINEAR":
+        raise ValueError(f"Unsupported time mapping {words[1]}")
+    m = re.fullmatch(r"(\d+)(mn|hr|dy|mo|yr)", words[3].lower())
+    if not m:
+        raise ValueError(f"Unsupported time increment {words[3]}")
+    unit = tunits[m.group(2)]
+    start = np.datetime64(gradstime(words[2]), unit)
+    return (start + int(m.group(1))*np.arange(n)).astype("datetime64[ns]")
+
+def readctl(ctlf:str, cwd:str=None) -> dict:
+    """
+    Parse a GrADS descriptor into {dset, undef, options, lon, lat, lev,
+    time, vars}, vars being an ordered list of (name, number of levels,
+    description). A DSET with ^ is relative to the .ctl, a plain relative
+    one to cwd (default the current directory), as for GrADS itself.
+    """
+    ctl = {"options": [], "vars": [], "undef": None}
+    with open(ctlf) as f:
+        lines = [l.split() for l in f if l.strip() and not l.lstrip().startswith("*")]
+    it = iter(lines)
+    for words in it:
+        key = words[0].upper()
+        if key == "DSET":
+            dset = words[1]
+            if dset.startswith("^"):
+                dset = os.path.join(os.path.dirname(os.path.abspath(ctlf)), dset[1:])
+            elif cwd is not None:
+                dset = os.path.join(cwd, dset)
+            ctl["dset"] = dset
+        elif key == "OPTIONS":
+            ctl["options"] += [w.lower() for w in words[1:]]
+        elif key == "UNDEF":
+            ctl["undef"] = float(words[1])
+        elif key == "XDEF":
+            ctl["lon"] = _axis(words[1:])
+        elif key == "YDEF":
+            ctl["lat"] = _axis(words[1:])
+        elif key == "ZDEF":
+            ctl["lev"] = _axis(words[1:])
+        elif key == "TDEF":
+            ctl["time"] = _taxis(words[1:])
+        elif key == "VARS":
+            for _ in range(int(words[1])):
+                v = next(it)
+                ctl["vars"].append((v[0], max(int(v[1]), 1), " ".join(v[3:])))
+        elif key in ("TEMPLATE", "PDEF", "XYHEADER", "THEADER", "FILEHEADER"):
+            raise ValueError(f"{ctlf}: {key} is not supported")
+    if "template" in ctl["options"]:
+        raise ValueError(f"{ctlf}: templated data sets are not supported")
+    return ctl
+
+def opengrads(ctlf:str, mode:str="r", partial:bool=False, cwd:str=None):
+    """
+    Return (ctl, fields) with fields = {name: memmap view (time, lat, lon)}
+    of the binary described by ctlf, zero copies. Variables with several
+    levels get views (time, lev, lat, lon). Undefined points keep ctl["undef"].
+    With partial, a binary shorter than described (still being written) is
+    exposed up to its last complete time step and ctl["time"] cut to match.
+    cwd is the directory of the program that wrote the data, see readctl.
+    """
+    ctl = readctl(ctlf, cwd)
+    nt, ny, nx = len(ctl["time"]), len(ctl["lat"]), len(ctl["lon"])
+    opts = ctl["options"]
+    dtype = np.dtype(">f4" if "big_endian" in opts else "<f4")
+    seq = 2 if "sequential" in opts else 0
+    nrec = sum(nlev for _, nlev, _ in ctl["vars"])
+
+    need = nt*nrec*(ny*nx+seq)*4
+    if partial:
+        nt = min(nt, os.path.getsize(ctl["dset"])//(nrec*(ny*nx+seq)*4))
+        ctl["time"] = ctl["time"][:nt]
+    elif os.path.getsize(ctl["dset"]) < need:
+        raise ValueError(f"{ctl['dset']}: shorter than the {need} bytes described by {ctlf}")
+    if nt:
+        raw = np.memmap(ctl["dset"], dtype=dtype, mode=mode, shape=(nt, nrec, ny*nx+seq))
+    else:
+        # nothing complete yet, numpy cannot map zero bytes
+        raw = np.empty((0, nrec, ny*nx+seq), dtype)
+
+    fields = {}
+    rec = 0
+    for name, nlev, _ in ctl["vars"]:
+        view = raw[:, rec:rec+nlev, seq//2:seq//2+ny*nx].reshape(nt, nlev, ny, nx)
+        if "yrev" in opts:
+            view = view[:, :, ::-1]
+        fields[name] = view[:, 0] if nlev == 1 else view
+        rec += nlev
+    if "yrev" in opts:
+        ctl["lat"] = ctl["lat"][::-1]
+    return ctl, fields
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Describe a GrADS data set")
+    parser.add_argument("ctl_file", type=str, help="GrADS descriptor, e.g. hires.ctl", metavar="ctl_file")
+    args = parser.parse_args()
+
+    ctl, fields = opengrads(args.ctl_file)
+    print(f"data   : {ctl['dset']} ({', '.join(ctl['options']) or 'direct'})")
+    print(f"grid   : {len(ctl['lon'])} x {len(ctl['lat'])}, lon {ctl['lon'][0]:g}..{ctl['lon'][-1]:g}, lat {ctl['lat'][0]:g}..{ctl['lat'][-1]:g}")
+    print(f"time   : {len(ctl['time'])} steps, {ctl['time'][0]} .. {ctl['time'][-1]}")
+    print(f"vars   : {' '.join(fields)}")
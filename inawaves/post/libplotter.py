@@ -681,11 +681,18 @@ class plotter:
         except:
             dirtitle = None
 
-        if var == 'ws':
+        # wind speed and arrow unit vectors come precomputed from grads2nc --derived when present
+        if var == 'ws' and 'ws' in ds:
+            mag = ds['ws']
+            ucomp, vcomp = 2*ds['wnd_u'], 2*ds['wnd_v']
+        elif var == 'ws':
             ucomp = ds[param.var1]
             vcomp = ds[param.var2]
             mag = np.sqrt(np.square(ucomp) + np.square(vcomp))
             ucomp, vcomp = 2*ucomp/mag, 2*vcomp/mag
+        elif f"{param.var2}_u" in ds:
+            mag = ds[param.var1]
+            ucomp, vcomp = 2*ds[f"{param.var2}_u"], 2*ds[f"{param.var2}_v"]
         else:
             try:
                 mag = ds[param.var1]
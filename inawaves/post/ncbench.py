@@ -0,0 +1,77 @@
+"""
+Benchmark of grads2nc chunking and compression profiles
+
+Converts one domain with every requested chunking x codec combination and
+reports write time, file size and the read latency of the two access
+patterns we serve: one whole field at a time step (maps) and the full time
+series at one grid point (point API).
+"""
+import os
+import time
+import shutil
+import tempfile
+import numpy as np
+from datetime import datetime
+from netCDF4 import Dataset
+
+import grads2nc
+
+def readlatency(netcdf:str, var:str="hs", nsample:int=10, seed:int=0):
+    # mean milliseconds to read one field and one point series of var
+    rng = np.random.default_rng(seed)
+    with Dataset(netcdf) as nc:
+        v = nc[var]
+        nt, ny, nx = v.shape
+        t = time.perf_counter()
+        for it in rng.integers(0, nt, nsample):
+            v[it]
+        tmap = (time.perf_counter() - t)/nsample*1e3
+        t = time.perf_counter()
+        for j, i in zip(rng.integers(0, ny, nsample), rng.integers(0, nx, nsample)):
+            v[:, j, i]
+        tseries = (time.perf_counter() - t)/nsample*1e3
+    return tmap, tseries
+
+def ncbench(baserun:datetime, ctl:str, chunkings:list, codecs:list, profile:str=grads2nc.profile,
+            outdir:str=None, keep:bool=False):
+    tmpdir = outdir or tempfile.mkdtemp(prefix="ncbench_", dir=os.getcwd())
+    os.makedirs(tmpdir, exist_ok=True)
+    results = []
+    try:
+        for chunking in chunkings:
+            for codec in codecs:
+                netcdf = os.path.join(tmpdir, f"w3g_{ctl}_{profile}_{chunking}_{codec}.nc")
+                t = time.perf_counter()
+                grads2nc.grads2netcdf(baserun, ctl, profile=profile, chunking=chunking,
+                                      codec=codec, netcdf=netcdf)
+                twrite = time.perf_counter() - t
+                tmap, tseries = readlatency(netcdf)
+                results.append((chunking, codec, twrite, os.path.getsize(netcdf), tmap, tseries))
+                if not keep:
+                    os.remove(netcdf)
+    finally:
+        if not keep and outdir is None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    print("======================================================================")
+    print(f"{'chunking':10s} {'codec':6s} {'write [s]':>10s} {'size [MB]':>10s} {'map [ms]':>10s} {'series [ms]':>12s}")
+    for chunking, codec, twrite, size, tmap, tseries in results:
+        print(f"{chunking:10s} {codec:6s} {twrite:10.2f} {size/2**20:10.1f} {tmap:10.2f} {tseries:12.2f}")
+    return results
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Benchmark grads2nc chunking and compression profiles",
+        epilog="Example:python ncbench.py hires --modelcycle 2024102000 --codec zlib5 zstd"
+    )
+    parser.add_argument("--modelcycle", type=lambda x: datetime.strptime(x, '%Y%m%d%H'), help="Model cycle -> YYYYMMDDHH. example --modelcycle 2024102000", metavar="modelcycle")
+    parser.add_argument("--chunking", type=str, nargs="+", default=list(grads2nc.chunkings), choices=list(grads2nc.chunkings), help="Chunk layouts to test. default all", metavar="chunking")
+    parser.add_argument("--codec", type=str, nargs="+", default=list(grads2nc.codecs), choices=list(grads2nc.codecs), help="Codecs to test. default all", metavar="codec")
+    parser.add_argument("--profile", type=str, default=grads2nc.profile, choices=list(grads2nc.profiles), help=f"Output data type. default {grads2nc.profile}", metavar="profile")
+    parser.add_argument("--outdir", type=str, default=None, help="Directory for the test files. default a temporary directory in the working directory", metavar="outdir")
+    parser.add_argument("--keep", action="store_true", help="Keep the test files")
+    parser.add_argument("ctl_file", type=str, help="ctl file. options: hires, reg, global", metavar="ctl_file")
+    args = parser.parse_args()
+
+    ncbench(args.modelcycle, args.ctl_file, args.chunking, args.codec, args.profile, args.outdir, args.keep)
@@ -0,0 +1,175 @@
+"""
+Streaming GrADS to NetCDF while WW3 is still integrating
+
+The output of grads2netcdf is written with an unlimited time axis and grows
+by slabs of time steps as out_grd.<domain> advances: gx_outf is run on the
+window of the next slab only, in a working directory of its own so the
+post-processing of the other domains keeps the fixed ww3.* names.
+
+The file is built as <netcdf>.part and copied over <netcdf> (through a
+rename) every publishevery slabs, so readers only ever open a closed file
+holding a complete prefix of the forecast. Each copy costs the whole file
+so far, hence not after every slab; the finished file is renamed, not
+copied. A step is only taken once the next one is in out_grd, or once the
+model has finished (done file), because WW3 may be writing the last record
+while gx_outf reads it.
+"""
+import os
+import time
+import shutil
+import subprocess
+import numpy as np
+from datetime import datetime
+
+import grads2nc
+from gradsio import opengrads
+
+publishevery = 4    # slabs appended between two copies of the growing file
+
+class slabwriter:
+    # grads2netcdf output on an unlimited time axis, published every publishevery appends
+    def __init__(self, netcdf:str, timeenc:tuple, lat, lon, profile:str=grads2nc.profile,
+                 chunking:str=grads2nc.chunking, codec:str=grads2nc.codec,
+                 transforms:dict=grads2nc.transforms, derived:dict=None,
+                 publishevery:int=publishevery):
+        self.netcdf, self.part = netcdf, netcdf + ".part"
+        self.time, t_unit, t_calendar = timeenc
+        self.profile, self.transforms, self.derived = profile, transforms, derived
+        self.nc = grads2nc.createnetcdf(self.part, self.time, t_unit, t_calendar, lat, lon,
+                                        profile, chunking, codec, unlimited=True, derived=derived)
+        self.ncchunk = 1 if self.nc["hs"].chunking() == "contiguous" else self.nc["hs"].chunking()[0]
+        self.nt = 0
+        self.publishevery, self.slabs = publishevery, 0
+
+    def append(self, fields:dict, n:int, tchunk:int=grads2nc.tchunk, undef:float=None) -> bool:
+        # the first n steps of fields are the next n steps of the forecast, True once published
+        tchunk = -(-tchunk//self.ncchunk)*self.ncchunk
+        for t0 in range(0, n, tchunk):
+            grads2nc.writesteps(self.nc, fields, slice(t0, min(t0+tchunk, n)), self.nt + t0,
+                                self.profile, self.transforms, self.derived, undef)
+        self.nc["time"][self.nt:self.nt+n] = self.time[self.nt:self.nt+n]
+        self.nt += n
+        self.slabs += 1
+        if self.slabs % self.publishevery:
+            return False
+        self.publish()
+        return True
+
+    def publish(self):
+        # flushed, the open file is consistent on disk and can be copied
+        self.nc.sync()
+        shutil.copyfile(self.part, self.netcdf + ".tmp")
+        os.replace(self.netcdf + ".tmp", self.netcdf)
+
+    def close(self, complete:bool=True):
+        # the finished file replaces the last copy, otherwise the last copy stays
+        self.nc.close()
+        if complete:
+            os.replace(self.part, self.netcdf)
+        else:
+            os.remove(self.part)
+
+def gxinp(template:str, start:datetime, dt:float, n:int) -> str:
+    # gx_outf.inp of template for n outputs from start, fields and grid range unchanged
+    with open(template) as f:
+        lines = f.read().splitlines()
+    for i, line in enumerate(lines):
+        if line.strip() and not line.lstrip().startswith("$"):
+            lines[i] = start.strftime(f" %Y%m%d %H%M%S {dt:.0f}. {n}")
+            break
+    return "\n".join(lines) + "\n"
+
+def gxwindow(work:str, exe:str, template:str, start:datetime, dt:float, n:int):
+    # run gx_outf in work for n outputs from start, (ctl, fields) of the complete steps it wrote
+    with open(os.path.join(work, "gx_outf.inp"), "w") as f:
+        f.write(gxinp(template, start, dt, n))
+    for f in ["ww3.grads", "ww3.ctl"]:
+        if os.path.exists(os.path.join(work, f)):
+            os.remove(os.path.join(work, f))
+    # a record still being written by WW3 can make gx_outf fail, the slab is retried later
+    if subprocess.run([exe], cwd=work).returncode or not os.path.exists(os.path.join(work, "ww3.ctl")):
+        return None, {}
+    # a DSET without ^ names the file in gx_outf's working directory
+    return opengrads(os.path.join(work, "ww3.ctl"), partial=True, cwd=work)
+
+def streamgrads(baserun:datetime, domain:str, dt:float=3600., nt:int=384, slab:int=grads2nc.tchunk,
+                exe:str="./gx_outf", template:str="gx_outf.inp", done:str=None, poll:float=60.,
+                netcdf:str=None, tchunk:int=grads2nc.tchunk, **kwargs):
+    """
+    Convert out_grd.<domain> to NetCDF slab after slab while WW3 writes it.
+    done is a file that exists once the integration is over, without one
+    out_grd is taken as complete. kwargs go to slabwriter.
+    """
+    print("======================================================================")
+    print(f"Streaming GrADS to NetCDF | modelcycle {baserun} | domain {domain} ...")
+    print("======================================================================")
+    if netcdf is None:
+        netcdf = grads2nc.defaultnetcdf(baserun, domain)
+    os.makedirs(os.path.dirname(os.path.abspath(netcdf)), exist_ok=True)
+    times = np.datetime64(baserun, "s") + np.arange(nt)*np.timedelta64(int(dt), "s")
+    timeenc = grads2nc.timeaxis(baserun, times)
+
+    # own links and gx_outf.inp, the working directory stays free for the other domains
+    work = os.path.abspath(f"stream.{domain}")
+    os.makedirs(work, exist_ok=True)
+    grads2nc.linkdomain(domain, work)
+    exe, template = os.path.abspath(exe), os.path.abspath(template)
+
+    writer = None
+    try:
+        while writer is None or writer.nt < nt:
+            t0 = writer.nt if writer else 0
+            n = min(slab, nt - t0)
+            # checked before gx_outf runs, out_grd is then complete for what it reads
+            finished = done is None or os.path.exists(done)
+            ctl, fields = gxwindow(work, exe, template, times[t0].astype(datetime), dt,
+                                   n if finished or t0+n == nt else n+1)
+            avail = len(ctl["time"]) if ctl else 0
+            if avail and ctl["time"][0] != times[t0]:
+                raise ValueError(f"gx_outf started at {ctl['time'][0]} instead of {times[t0]}")
+            ready = min(avail if finished else avail-1, n)
+            if ready < n and not finished:
+                print(f"  step {t0+max(ready, 0)+1} of {nt} not in out_grd.{domain} yet, next try in {poll:.0f} s")
+                time.sleep(poll)
+                continue
+            if ready:
+                if writer is None:
+                    writer = slabwriter(netcdf, timeenc, ctl["lat"].astype(np.float32),
+                                        ctl["lon"].astype(np.float32), **kwargs)
+                published = writer.append(fields, ready, tchunk, ctl["undef"])
+                print(f"  steps {t0+1}-{t0+ready} of {nt} {'published' if published else 'written'}")
+            if ready < n:
+                raise RuntimeError(f"out_grd.{domain} ends after step {t0+ready} of {nt}")
+    except BaseException:
+        if writer is not None:
+            writer.close(complete=False)
+        raise
+    writer.close()
+    print(f"File saved at {netcdf}")
+    return netcdf
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Streaming GrADS to NetCDF Converter, follows out_grd while WW3 integrates",
+        epilog="Example:python ncstream.py hires --modelcycle 2024102000 --done ../main/ww3.done"
+    )
+    parser.add_argument("--modelcycle", type=lambda x: datetime.strptime(x, '%Y%m%d%H'), help="Model cycle -> YYYYMMDDHH. example --modelcycle 2024102000", metavar="modelcycle")
+    parser.add_argument("--dt", type=float, default=3600., help="Output increment in seconds. default 3600", metavar="dt")
+    parser.add_argument("--nt", type=int, default=384, help="Number of output times. default 384", metavar="nt")
+    parser.add_argument("--slab", type=int, default=grads2nc.tchunk, help=f"Time steps converted at once. default {grads2nc.tchunk}", metavar="slab")
+    parser.add_argument("--publish", type=int, default=publishevery, help=f"Slabs written between two copies to the NetCDF file readers see. default {publishevery}", metavar="publish")
+    parser.add_argument("--poll", type=float, default=60., help="Seconds between checks of out_grd. default 60", metavar="poll")
+    parser.add_argument("--done", type=str, default=None, help="File that exists once the integration has finished. default none, out_grd is complete", metavar="done")
+    parser.add_argument("--gx_outf", type=str, default="./gx_outf", help="gx_outf executable. default ./gx_outf", metavar="gx_outf")
+    parser.add_argument("--template", type=str, default="gx_outf.inp", help="gx_outf.inp with the fields and grid range. default gx_outf.inp", metavar="template")
+    parser.add_argument("--profile", type=str, default=grads2nc.profile, choices=list(grads2nc.profiles), help=f"Output data type of the variables. default {grads2nc.profile}", metavar="profile")
+    parser.add_argument("--chunking", type=str, default=grads2nc.chunking, choices=list(grads2nc.chunkings), help=f"Chunk layout. default {grads2nc.chunking}", metavar="chunking")
+    parser.add_argument("--codec", type=str, default=grads2nc.codec, choices=list(grads2nc.codecs), help=f"Compression of the variables. default {grads2nc.codec}", metavar="codec")
+    parser.add_argument("--derived", action="store_true", help=f"Also store the derived variables {' '.join(grads2nc.derivations)}")
+    parser.add_argument("domain", type=str, help="Domain with out_grd.<domain> and mod_def.<domain>. options: hires, reg, global", metavar="domain")
+    args = parser.parse_args()
+
+    streamgrads(args.modelcycle, args.domain, args.dt, args.nt, args.slab, args.gx_outf, args.template,
+                args.done, args.poll, profile=args.profile, chunking=args.chunking, codec=args.codec,
+                derived=grads2nc.derivations if args.derived else None, publishevery=args.publish)
@@ -0,0 +1,157 @@
+"""
+WW3 out_grd to NetCDF without the GrADS intermediate
+
+Runs ww3_ounf on out_grd.<domain> for only the fields we publish and streams
+its output through the grads2nc writer, so the result has the same schema,
+corrections and attributes as grads2netcdf. ww3_ounf reads the WW3 binary
+with the model's own code (sea points, mod_def map) instead of gx_outf
+writing every field of every grid point uncompressed for us to read back.
+"""
+import os
+import glob
+import subprocess
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from netCDF4 import Dataset, num2date
+
+import grads2nc
+
+# fields requested from ww3_ounf, names as in ww3_shel.inp
+ounffields = "WND HS LM T01 DIR DP PHS PTP PDIR"
+ounfprefix = "ounf."
+
+# ww3_ounf variable of every GrADS source name in grads2nc.transforms
+ounfnames = {
+    "hs": "hs", "lm": "lm", "t01": "t01", "dir": "dir", "dp": "dp",
+    "uwnd": "uwnd", "vwnd": "vwnd",
+    "phs00": "phs0", "phs01": "phs1", "phs02": "phs2",
+    "ptp00": "ptp0", "ptp01": "ptp1", "ptp02": "ptp2",
+    "pdi00": "pdir0", "pdi01": "pdir1", "pdi02": "pdir2",
+}
+
+# corrections from ww3_ounf units. gx_outf gives directions as the WW3
+# internal cartesian angle (radians), ww3_ounf as nautical "from" degrees
+# = 630 - cartesian, so the cartesian degree is 270 - nautical wrapped into
+# [0, 360). Masked points arrive as NaN, hence no lower bound for them.
+ounftransforms = dict(grads2nc.transforms)
+for var in ["dir", "dp", "pdi00", "pdi01", "pdi02"]:
+    ounftransforms[var] = (var, -1., 270., -np.inf, 360.)
+
+def ounfinp(baserun:datetime, dt:float, nt:int, fields:str=ounffields, prefix:str=ounfprefix) -> str:
+    # ww3_ounf.inp : one NetCDF-4 float file per month with all fields, 3 swell partitions
+    return "\n".join([
+        "$ WAVEWATCH III Grid output post-processing ( NetCDF )",
+        "$ First output time, increment (s), number of outputs",
+        baserun.strftime(f"  %Y%m%d %H%M%S {dt:.0f}. {nt}"),
+        "$ Output request flags (namelist selection)",
+        "  N",
+        f"  {fields}",
+        "$ NetCDF version, variable type (4 = REAL)",
+        "  4 4",
+        "$ Swell partitions",
+        "  0 1 2",
+        "$ All variables in the same file",
+        "  T",
+        "$ File prefix, characters in date, IX and IY ranges",
+        f"  {prefix}",
+        "  6",
+        "  1 1000000 1 1000000",
+        "$ End of input file",
+        "",
+    ])
+
+def runounf(baserun:datetime, domain:str, dt:float, nt:int, exe:str="./ww3_ounf") -> list:
+    # run ww3_ounf for one domain in the working directory, as create_grads.sh does for gx_outf
+    grads2nc.linkdomain(domain)
+    prefix = f"{ounfprefix}{domain}."
+    for f in glob.glob(prefix + "*.nc"):
+        os.remove(f)
+    with open("ww3_ounf.inp", "w") as f:
+        f.write(ounfinp(baserun, dt, nt, prefix=prefix))
+    subprocess.run([exe], check=True)
+    files = sorted(glob.glob(prefix + "*.nc"))
+    if not files:
+        raise RuntimeError(f"{exe} wrote no {prefix}*.nc")
+    return files
+
+class ounffield:
+    # one ww3_ounf variable across the monthly files, read by time slice as float32 with NaN
+    def __init__(self, ncs:list, name:str):
+        self.vars = [nc[name] for nc in ncs]
+        self.ends = np.cumsum([v.shape[0] for v in self.vars])
+        self.shape = (int(self.ends[-1]),) + self.vars[0].shape[1:]
+
+    def __getitem__(self, tsl:slice):
+        t0, t1, _ = tsl.indices(self.shape[0])
+        parts = []
+        start = 0
+        for var, end in zip(self.vars, self.ends):
+            a, b = max(t0, start), min(t1, end)
+            if a < b:
+                parts.append(np.ma.filled(var[a-start:b-start].astype(np.float32), np.nan))
+            start = end
+        return np.concatenate(parts)
+
+def openounf(files:list):
+    # time, lat, lon and {GrADS source name: ounffield} of the ww3_ounf output
+    ncs = [Dataset(f) for f in files]
+    missing = [n for n in ounfnames.values() if n not in ncs[0].variables]
+    if missing:
+        raise ValueError(f"{files[0]} has no {', '.join(missing)}, variables are {', '.join(ncs[0].variables)}")
+    times = []
+    for nc in ncs:
+        t = nc["time"]
+        times += list(num2date(t[:], t.units, only_use_cftime_datetimes=False, only_use_python_datetimes=True))
+    times = pd.to_datetime(times).round("s")
+    lat, lon = ncs[0]["latitude"][:], ncs[0]["longitude"][:]
+    fields = {src: ounffield(ncs, name) for src, name in ounfnames.items()}
+    return ncs, times, lat, lon, fields
+
+def ounf2netcdf(baserun:datetime, domain:str, dt:float=3600., nt:int=384, exe:str="./ww3_ounf",
+                keep:bool=False, netcdf:str=None, **kwargs):
+    print("======================================================================")
+    print(f"out_grd to NetCDF Converter | modelcycle {baserun} | domain {domain} ...")
+    print("======================================================================")
+    if netcdf is None:
+        netcdf = grads2nc.defaultnetcdf(baserun, domain)
+    os.makedirs(os.path.dirname(os.path.abspath(netcdf)), exist_ok=True)
+    files = runounf(baserun, domain, dt, nt, exe)
+    print(f"Reading {', '.join(files)} ...")
+    ncs, times, lat, lon, fields = openounf(files)
+    try:
+        grads2nc.writenetcdf(netcdf, fields, grads2nc.timeaxis(baserun, times),
+                             np.asarray(lat, np.float32), np.asarray(lon, np.float32),
+                             transforms=kwargs.pop("transforms", ounftransforms), **kwargs)
+    finally:
+        for nc in ncs:
+            nc.close()
+    if not keep:
+        for f in files:
+            os.remove(f)
+    print(f"File saved at {netcdf}")
+    return netcdf
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="WW3 out_grd to NetCDF Converter (through ww3_ounf)",
+        epilog="Example:python ounf2nc.py global reg hires --modelcycle 2024102000"
+    )
+    parser.add_argument("--modelcycle", type=lambda x: datetime.strptime(x, '%Y%m%d%H'), help="Model cycle -> YYYYMMDDHH. example --modelcycle 2024102000", metavar="modelcycle")
+    parser.add_argument("--dt", type=float, default=3600., help="Output increment in seconds. default 3600", metavar="dt")
+    parser.add_argument("--nt", type=int, default=384, help="Number of output times. default 384", metavar="nt")
+    parser.add_argument("--exe", type=str, default="./ww3_ounf", help="ww3_ounf executable. default ./ww3_ounf", metavar="exe")
+    parser.add_argument("--keep", action="store_true", help="Keep the ww3_ounf files")
+    parser.add_argument("--profile", type=str, default=grads2nc.profile, choices=list(grads2nc.profiles), help=f"Output data type of the variables. default {grads2nc.profile}", metavar="profile")
+    parser.add_argument("--chunking", type=str, default=grads2nc.chunking, choices=list(grads2nc.chunkings), help=f"Chunk layout. default {grads2nc.chunking}", metavar="chunking")
+    parser.add_argument("--codec", type=str, default=grads2nc.codec, choices=list(grads2nc.codecs), help=f"Compression of the variables. default {grads2nc.codec}", metavar="codec")
+    parser.add_argument("--derived", action="store_true", help=f"Also store the derived variables {' '.join(grads2nc.derivations)}")
+    parser.add_argument("domains", type=str, nargs="+", help="Domains with out_grd.<domain> and mod_def.<domain>. options: hires, reg, global", metavar="domains")
+    args = parser.parse_args()
+
+    # ww3_ounf works on the fixed out_grd.ww3/mod_def.ww3 names, domains run one after the other
+    for domain in args.domains:
+        ounf2netcdf(args.modelcycle, domain, args.dt, args.nt, args.exe, args.keep,
+                    profile=args.profile, chunking=args.chunking, codec=args.codec,
+                    derived=grads2nc.derivations if args.derived else None)
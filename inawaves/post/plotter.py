@@ -84,6 +84,9 @@ def main(model, baserun:datetime, out_dir=False):
         ds['hmax'] = ds['hmax'].fillna(0.0)
         ds['t01'] = ds['t01'].fillna(0.0)
         ds['lm'] = ds['lm'].fillna(0.0)
+        if 'ws' in ds:
+            # as computed from the filled uwnd/vwnd
+            ds['ws'] = ds['ws'].fillna(0.0)
         Parallel(n_jobs=48)(
             delayed(
                 run_plot
@@ -0,0 +1,123 @@
+"""
+Post-processing pipeline : gx_outf -> grads2nc -> plotter, per domain
+
+create_grads.sh, grads2nc.py and plotter.py used to run as three barriers
+over all domains. Here every domain goes to its next stage as soon as the
+previous one is done: gx_outf runs domain after domain (it works on the
+fixed ww3.* names of the working directory), a domain is converted in a
+process pool as soon as its .grads/.ctl pair is complete and it is plotted
+as soon as its NetCDF file is closed. In the production run this replaces
+grads2nc.grads2netcdf_domains, which stays for converting existing .ctl
+files from the grads2nc.py command line.
+"""
+import os
+import sys
+import subprocess
+from time import perf_counter
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import grads2nc
+
+# domains plotted by plotter.py, which reads w3g_hires_*.nc
+plotdomains = ["hires"]
+plotter = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plotter.py")
+
+def gxoutf(domain:str, exe:str="./gx_outf"):
+    # create_grads.sh for one domain, <domain>.ctl only appears once <domain>.grads is complete
+    grads2nc.linkdomain(domain)
+    subprocess.run([exe], check=True)
+    os.replace("ww3.grads", f"{domain}.grads")
+    with open("ww3.ctl") as f:
+        ctl = f.read().replace("ww3.grads", f"{domain}.grads")
+    with open(f"{domain}.ctl.tmp", "w") as f:
+        f.write(ctl)
+    os.replace(f"{domain}.ctl.tmp", f"{domain}.ctl")
+
+def plot(baserun:datetime, out_dir:str=None) -> subprocess.Popen:
+    cmd = [sys.executable, plotter, "inawaves", baserun.strftime("%Y%m%d%H")]
+    if out_dir:
+        cmd += ["--out_dir", out_dir]
+    return subprocess.Popen(cmd)
+
+def postproc(baserun:datetime, domains:list, nproc:int=None, gxexe:str="./gx_outf",
+             out_dir:str=None, grads:bool=True, plots:bool=True, derived:bool=False, **kwargs):
+    """
+    Run the post-processing of domains in order, overlapping the stages.
+    Put the domain that is plotted first so its maps start as early as possible.
+    With derived, the plotted domains also get the grads2nc derived variables
+    the plotter draws from. kwargs go to grads2nc.grads2netcdf.
+    """
+    t0 = perf_counter()
+    timing = {d: {} for d in domains}
+    converting = {}
+    plotting = {}
+
+    def harvest(block:bool):
+        # collect finished conversions and start plotting them
+        done, _ = wait(list(converting), timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for fut in done:
+            domain, t = converting.pop(fut)
+            fut.result()
+            timing[domain]["netcdf"] = perf_counter() - t
+            print(f">>> {domain} NetCDF done after {perf_counter() - t0:.0f} s")
+            if plots and domain in plotdomains:
+                plotting[domain] = (plot(baserun, out_dir), perf_counter())
+
+    try:
+        with ProcessPoolExecutor(nproc or len(domains)) as pool:
+            for domain in domains:
+                if grads:
+                    t = perf_counter()
+                    gxoutf(domain, gxexe)
+                    timing[domain]["grads"] = perf_counter() - t
+                    print(f">>> {domain} GrADS done after {perf_counter() - t0:.0f} s")
+                extra = {"derived": grads2nc.derivations} if derived and domain in plotdomains else {}
+                converting[pool.submit(grads2nc.grads2netcdf, baserun, domain, **kwargs, **extra)] = (domain, perf_counter())
+                harvest(False)
+            while converting:
+                harvest(True)
+    except BaseException:
+        # a failed gx_outf or conversion fails the run, no plotter outlives it
+        for domain, (proc, t) in plotting.items():
+            proc.terminate()
+            proc.wait()
+            print(f">>> {domain} plots stopped after {perf_counter() - t0:.0f} s")
+        raise
+
+    failed = []
+    for domain, (proc, t) in plotting.items():
+        if proc.wait():
+            failed.append(domain)
+        timing[domain]["plot"] = perf_counter() - t
+        print(f">>> {domain} plots done after {perf_counter() - t0:.0f} s")
+
+    print("======================================================================")
+    print(f"{'domain':10s} {'gx_outf [s]':>12s} {'netcdf [s]':>12s} {'plot [s]':>12s}")
+    for domain in domains:
+        row = [timing[domain].get(k) for k in ["grads", "netcdf", "plot"]]
+        print(f"{domain:10s} " + " ".join(f"{x:12.1f}" if x is not None else f"{'-':>12s}" for x in row))
+    print(f"{'total':10s} {perf_counter() - t0:12.1f}")
+    if failed:
+        raise RuntimeError(f"plotter failed for {', '.join(failed)}")
+    return timing
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Pipelined WW3 post-processing : gx_outf, NetCDF conversion and plots per domain",
+        epilog="Example:python postproc.py hires reg global --modelcycle 2024102000 --out_dir /tmp/img"
+    )
+    parser.add_argument("--modelcycle", type=lambda x: datetime.strptime(x, '%Y%m%d%H'), help="Model cycle -> YYYYMMDDHH. example --modelcycle 2024102000", metavar="modelcycle")
+    parser.add_argument("--out_dir", type=str, default=None, help="Plot output directory, passed to plotter.py", metavar="out_dir")
+    parser.add_argument("--nproc", type=int, default=None, help="Conversion processes. default one per domain", metavar="nproc")
+    parser.add_argument("--gx_outf", type=str, default="./gx_outf", help="gx_outf executable. default ./gx_outf", metavar="gx_outf")
+    parser.add_argument("--no-grads", dest="grads", action="store_false", help="Use existing <domain>.grads/.ctl instead of running gx_outf")
+    parser.add_argument("--no-plot", dest="plots", action="store_false", help="Do not run plotter.py")
+    parser.add_argument("--derived", action="store_true", help="Store the variables derived for the plots (wind speed, arrow unit vectors) in the plotted domains")
+    parser.add_argument("--profile", type=str, default=grads2nc.profile, choices=list(grads2nc.profiles), help=f"Output data type of the variables. default {grads2nc.profile}", metavar="profile")
+    parser.add_argument("domains", type=str, nargs="+", help="Domains in processing order. options: hires, reg, global", metavar="domains")
+    args = parser.parse_args()
+
+    postproc(args.modelcycle, args.domains, args.nproc, args.gx_outf, args.out_dir, args.grads, args.plots,
+             args.derived, profile=args.profile)
@@ -7,25 +7,56 @@ Created on Fri May  3 10:53:05 2019
 
 import os
 import datetime
-import numpy as np
-from time import sleep
-import subprocess
+from time import sleep, monotonic
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
+import urllib.error
+import urllib.parse
 import urllib.request
 
+from gribcheck import gribvalid
+import manifest
+
 #%% Global variables
 maxtry = 100
 waitsec = 300
+nworkers = 8        # forecast hours fetched at once
+maxconn = 4         # simultaneous connections allowed per upstream host
+backoff0 = 10       # first retry delay [s], doubled per failure up to waitsec
+chunksize = 1 << 20 # streaming block size [bytes]
+cadence = '3'       # forecast-hour spacing, '<until>:<step>,...' e.g. '120:1,3' (see fcthours)
+bbox = (0, 360, -90, 90)   # leftlon, rightlon, bottomlat, toplat requested from NOMADS
+pollsec = 30        # re-probe interval for hours not yet published [s]
+maxpoll = 6*3600    # give up on an hour unpublished this long after its first miss and the last arrival [s]
+
+_hostsem = {}
+_hostlock = threading.Lock()
 
 #%% Functions
-def domsel(dom):
+def domsel(dom, bbox=bbox):
     if dom == 'global':
+        lon0, lon1, lat0, lat1 = bbox
+        # the filter only cuts when subregion is set, the full globe keeps
+        # the native 1440x721 grid without it
+        subreg = '' if tuple(bbox) == (0, 360, -90, 90) else '&subregion='
         gfsurl = 'https://nomads.ncep.noaa.gov/cgi-bin/filter_gfs_0p25.pl'
-        gfsopt = '&lev_10_m_above_ground=on&var_DPT=on&var_UGRD=on&var_VGRD=on&lev_mean_sea_level=on&var_PRMSL=on&leftlon=0&rightlon=360&toplat=90&bottomlat=-90&dir=%2F'
+        gfsopt = f'&lev_10_m_above_ground=on&var_DPT=on&var_UGRD=on&var_VGRD=on&lev_mean_sea_level=on&var_PRMSL=on{subreg}&leftlon={lon0:g}&rightlon={lon1:g}&toplat={lat1:g}&bottomlat={lat0:g}&dir=%2F'
         midsufgfsfile = 'pgrb2.0p25'
         
     return gfsurl, gfsopt, midsufgfsfile
 
+def probesel(dom):
+    # plain data tree, the .idx of a forecast hour only appears once its GRIB is complete
+    if dom == 'global':
+        probeurl = 'https://nomads.ncep.noaa.gov/pub/data/nccf/com/gfs/prod'
+    
+    return probeurl
+
+class NotPublished(Exception):
+    pass
+
 def gfsdown(URL, gfslocalfile):
     
     try:
@@ -37,10 +68,7 @@ def gfsdown(URL, gfslocalfile):
     
     for i in range(maxtry):
         try:
-            response = urllib.request.urlopen(URL, timeout = 30)
-            data = response.read()
-            with open(gfslocalfile, 'wb') as f:  
-                f.write(data)
+            gfsfetch(URL, gfslocalfile)
             break
         except:
             print(f'Download Failed, Attemp : {i}')
@@ -51,6 +79,154 @@ def gfsdown(URL, gfslocalfile):
         raise StopIteration('Error: Maximum retry has been reached, DOWNDLOAD FAILED!')
     
     return(gfslocalfile)
+
+def hostslot(URL, maxconn=maxconn):
+    host = urllib.parse.urlsplit(URL).netloc
+    with _hostlock:
+        if host not in _hostsem:
+            _hostsem[host] = threading.BoundedSemaphore(maxconn)
+        return _hostsem[host]
+
+def gfsfetch(URL, gfslocalfile, maxconn=maxconn):
+    # single attempt, no retry; the host slot bounds concurrent requests to NOMADS.
+    # Data is streamed to <gfslocalfile>.part and resumed with a Range request
+    # on the next attempt; the final name only appears once the file is complete.
+    partfile = gfslocalfile + '.part'
+    offset = os.path.getsize(partfile) if os.path.isfile(partfile) else 0
+    
+    req = urllib.request.Request(URL)
+    if offset:
+        req.add_header('Range', f'bytes={offset}-')
+    
+    with hostslot(URL, maxconn):
+        try:
+            response = urllib.request.urlopen(req, timeout = 30)
+        except urllib.error.HTTPError as e:
+            if e.code == 416:
+                # stale partial larger than upstream file, start over
+                os.remove(partfile)
+            raise
+        
+        with response:
+            if offset and response.status != 206:
+                # server ignored the Range header, full body follows
+                offset = 0
+            length = response.headers.get('Content-Length')
+            expected = offset + int(length) if length is not None else None
+            
+            with open(partfile, 'ab' if offset else 'wb') as f:
+                while True:
+                    block = response.read(chunksize)
+                    if not block:
+                        break
+                    f.write(block)
+                f.flush()
+                os.fsync(f.fileno())
+    
+    size = os.path.getsize(partfile)
+    if expected is not None and size != expected:
+        raise IOError(f'Incomplete download {partfile}: {size} of {expected} bytes')
+    os.replace(partfile, gfslocalfile)
+    return(gfslocalfile)
+
+def gfsprobe(probeURL, maxconn=maxconn):
+    # cheap HEAD request, tells 'not yet published' apart from transport errors
+    req = urllib.request.Request(probeURL, method='HEAD')
+    with hostslot(probeURL, maxconn):
+        try:
+            urllib.request.urlopen(req, timeout = 30).close()
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                raise NotPublished(probeURL)
+            raise
+    return True
+
+def gfsget(URL, gfslocalfile, probeURL=None, maxconn=maxconn):
+    if probeURL is not None:
+        gfsprobe(probeURL, maxconn)
+    try:
+        return gfsfetch(URL, gfslocalfile, maxconn)
+    except urllib.error.HTTPError as e:
+        if e.code == 404:
+            raise NotPublished(URL)
+        raise
+
+def backoff(attempt):
+    delay = min(backoff0 * 2**attempt, waitsec)
+    return delay * random.uniform(0.8, 1.2)
+
+def gfsdown_pool(jobs, nworkers=nworkers, maxconn=maxconn, ondone=None):
+    # jobs : list of (fct, URL, gfslocalfile, probeURL), probeURL may be None
+    # Every forecast hour keeps its own retry state, so a failing hour waits
+    # out its backoff without holding a worker or blocking the other hours.
+    # Hours not yet published upstream are re-probed every pollsec and do not
+    # count against maxtry, an hour is given up once nothing arrived for
+    # maxpoll since its first miss; transport errors use the exponential backoff.
+    # ondone(fct, gfslocalfile) runs in the calling thread after each download,
+    # returning False sends the hour back to the retry queue.
+    pending = {}
+    for fct, URL, gfslocalfile, probeURL in jobs:
+        pending[fct] = {'URL': URL, 'file': gfslocalfile, 'probe': probeURL,
+                        'attempt': 0, 'next': 0., 'since': None}
+    running = {}
+    arrived = monotonic()
+    
+    with ThreadPoolExecutor(max_workers=nworkers) as pool:
+        while pending or running:
+            now = monotonic()
+            for fct in sorted(pending):
+                if len(running) >= nworkers:
+                    break
+                st = pending[fct]
+                if st['next'] <= now:
+                    print('Downloading %s' % st['file'], f"{st['URL']}")
+                    fut = pool.submit(gfsget, st['URL'], st['file'], st['probe'], maxconn)
+                    running[fut] = (fct, pending.pop(fct))
+            
+            if not running:
+                sleep(max(min(st['next'] for st in pending.values()) - now, 0))
+                continue
+            
+            timeout = None
+            if pending:
+                timeout = max(min(st['next'] for st in pending.values()) - now, 0)
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for fut in done:
+                fct, st = running.pop(fut)
+                try:
+                    fut.result()
+                    if ondone is not None and not ondone(fct, st['file']):
+                        raise ValueError('downloaded file failed validation')
+                    print(f"Downloaded {st['file']}")
+                    arrived = monotonic()
+                except NotPublished:
+                    # GFS publishes hour after hour, so the wait of an hour counts
+                    # from its first miss or from the last hour that arrived
+                    if st['since'] is None:
+                        st['since'] = monotonic()
+                    if monotonic() - max(st['since'], arrived) > maxpoll:
+                        for f in running:
+                            f.cancel()
+                        raise StopIteration(f"Error: {st['file']} not published after {maxpoll/3600} h, DOWNDLOAD FAILED!")
+                    print(f'f{str(fct).zfill(3)} not published yet, probing again in {pollsec} s')
+                    st['next'] = monotonic() + pollsec * random.uniform(0.9, 1.1)
+                    pending[fct] = st
+                    # GFS publishes hours in order, later hours wait for this one
+                    for later in pending:
+                        if later > fct:
+                            pending[later]['next'] = max(pending[later]['next'], st['next'])
+                except Exception as e:
+                    delay = backoff(st['attempt'])
+                    print(f"Download Failed f{str(fct).zfill(3)} ({e}), Attemp : {st['attempt']}")
+                    st['attempt'] += 1
+                    if st['attempt'] >= maxtry:
+                        for f in running:
+                            f.cancel()
+                        raise StopIteration(f"Error: Maximum retry has been reached for {st['file']}, DOWNDLOAD FAILED!")
+                    print(f'Retrying f{str(fct).zfill(3)} in {delay:.0f} s')
+                    st['next'] = monotonic() + delay
+                    pending[fct] = st
+    return True
     
 def gendts():
     dtn = datetime.datetime.utcnow()
@@ -69,9 +245,9 @@ def gendts():
     
     return dts
 
-def gengfsURL(outfol, ftime,dt,cycl,dom):
+def gengfsURL(outfol, ftime,dt,cycl,dom,bbox=bbox):
     fts = str(ftime).zfill(3)
-    gfsurl, gfsopt, midsufgfsfile = domsel(dom)
+    gfsurl, gfsopt, midsufgfsfile = domsel(dom, bbox)
     
     gfsfile = f'gfs.t{cycl}z.{midsufgfsfile}.f{fts}'
     URL = f"{gfsurl}?file={gfsfile}{gfsopt}gfs.{dt}%2F{cycl}%2Fatmos"
@@ -81,15 +257,50 @@ def gengfsURL(outfol, ftime,dt,cycl,dom):
     
     return URL, gfslocalfile
 
+def genprobeURL(ftime,dt,cycl,dom):
+    fts = str(ftime).zfill(3)
+    gfsurl, gfsopt, midsufgfsfile = domsel(dom)
+    
+    gfsfile = f'gfs.t{cycl}z.{midsufgfsfile}.f{fts}'
+    probeURL = f"{probesel(dom)}/gfs.{dt}/{cycl}/atmos/{gfsfile}.idx"
+    
+    return probeURL
+
+def parsecadence(cad):
+    # '120:1,240:3,6' -> [(120, 1), (240, 3), (None, 6)], last step runs to maxt
+    segs = []
+    for seg in str(cad).split(','):
+        if ':' in seg:
+            until, step = seg.split(':')
+            segs.append((int(until), int(step)))
+        else:
+            segs.append((None, int(seg)))
+    return segs
+
+def fcthours(maxt, cad=cadence):
+    # forecast hours to fetch; each segment starts on a multiple of its step
+    # so that e.g. 3-hourly steps after 120 h fall on published hours
+    hours = []
+    h = 0
+    for until, step in parsecadence(cad):
+        lim = maxt if until is None else min(until, maxt)
+        h = -(-h//step)*step
+        while h <= lim:
+            hours.append(h)
+            h += step
+    return hours
+
 def gfscheck(gfslocalfile):
     if os.path.isfile(gfslocalfile):
-        line = subprocess.check_output(['tail', '-1', gfslocalfile])
-        if line[-4:] == b'7777':
-            return True
+        return gribvalid(gfslocalfile)
     else:
         return False
 
-def main_downloader(outfol=None,dts=None,dom='global',maxt=240,onlycheck=False):
+def main_downloader(outfol=None,dts=None,dom='global',maxt=240,onlycheck=False,
+                    nworkers=nworkers,maxconn=maxconn,probe=True,onverified=None,
+                    bbox=bbox,cadence=cadence):
+    # onverified(fct, gfslocalfile) is called once for every verified forecast
+    # hour, already present or freshly downloaded, so consumers can start early
     if dts is None:
         dts = gendts()
         dt = dts[:8]
@@ -100,17 +311,35 @@ def main_downloader(outfol=None,dts=None,dom='global',maxt=240,onlycheck=False):
         
     outd = os.path.join(outfol,dts)
     
-    fcttime = np.arange(0,maxt+1,3)
+    fcttime = fcthours(maxt, cadence)
+    subregion = None if tuple(bbox) == (0, 360, -90, 90) else bbox
+    man = manifest.loadmanifest(outd, dts)
+    man['expected'] = [int(fct) for fct in fcttime]
+    jobs = []
     for fct in fcttime:
-        URL, gfslocalfile = gengfsURL(outd,fct,dt,cycl,dom)
-        hasilcheck = gfscheck(gfslocalfile)
+        URL, gfslocalfile = gengfsURL(outd,fct,dt,cycl,dom,bbox)
+        hasilcheck = manifest.verify(man, fct, gfslocalfile, subregion)
         if hasilcheck:
             print('Checking file %s: OK' % gfslocalfile)
+            if onverified is not None:
+                onverified(int(fct), gfslocalfile)
             continue
         else:
-            if not onlycheck:
-                print('Downloading %s' % gfslocalfile, f'{URL}')
-                gfsdown(URL, gfslocalfile)
+            probeURL = genprobeURL(fct,dt,cycl,dom) if probe else None
+            jobs.append((int(fct), URL, gfslocalfile, probeURL))
+    if os.path.isdir(outd):
+        manifest.savemanifest(outd, man)
+    
+    def ondone(fct, gfslocalfile):
+        ok = manifest.verify(man, fct, gfslocalfile, subregion)
+        manifest.savemanifest(outd, man)
+        if ok and onverified is not None:
+            onverified(fct, gfslocalfile)
+        return ok
+    
+    if jobs and not onlycheck:
+        os.makedirs(outd, exist_ok=True)
+        gfsdown_pool(jobs, nworkers=nworkers, maxconn=maxconn, ondone=ondone)
     return True
     
 
@@ -133,6 +362,25 @@ if __name__ == '__main__':
                         help='Maximum forecast time, format = "t"',
                         default = 241)
     
+    parser.add_argument('-w', action='store', dest='nworkers',
+                        help='Number of forecast hours downloaded concurrently',
+                        default = nworkers)
+    
+    parser.add_argument('-c', action='store', dest='maxconn',
+                        help='Maximum simultaneous connections per host',
+                        default = maxconn)
+    
+    parser.add_argument('-b', action='store', dest='bbox',
+                        help='Bounding box, format = "leftlon,rightlon,bottomlat,toplat"',
+                        default = ','.join(f'{x:g}' for x in bbox))
+    
+    parser.add_argument('-p', action='store', dest='cadence',
+                        help='Forecast hour cadence, format = "until:step,...,step". Example : 120:1,3',
+                        default = cadence)
+    
+    parser.add_argument('--no-probe', action='store_false', dest='probe',
+                        help='Do not probe upstream availability before downloading')
+    
     parser.add_argument('--version', action='version', version='%(prog)s 1.2 by luthfi.imanal@gmail.com')
     
     r = parser.parse_args()
@@ -140,4 +388,9 @@ if __name__ == '__main__':
     main_downloader(r.output_directory,
                     dts=r.date,
                     dom=r.dom,
-                    maxt=int(r.maxt))
+                    maxt=int(r.maxt),
+                    nworkers=int(r.nworkers),
+                    maxconn=int(r.maxconn),
+                    probe=r.probe,
+                    bbox=tuple(float(x) for x in r.bbox.split(',')),
+                    cadence=r.cadence)
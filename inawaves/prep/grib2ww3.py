@@ -7,67 +7,607 @@ Created on Sat May  4 11:16:52 2019
 @modified by: tyo
 """
 import os
+import json
+import datetime
+import time
+import struct
 import subprocess
 
-def grib2ww3(fgrdir,fout,maxt = 240):
+import windcube
+
+#%% Global variables
+bufsize = 1 << 22
+maxtable = 1 << 20
+cachedays = 2       # converted records unused for this long are pruned
+
+_manifests = {}
+
+# ww3_prep 'NAME' data-file line (FROM, IDLA, IDFM, formats) per output format,
+# IDFM 1 : formatted text, IDFM 3 : unformatted binary
+prepname = {
+    'txt' : ("  'NAME' 1 1 '(..T..)' '(..T..)' ", "wind.txt"),
+    'bin' : ("  'NAME' 1 3 '(..T..)' '(..T..)' ", "wind.bin"),
+}
+
+#%% Functions
+def gribdecode(fgr):
+    # 10u/10v and the valid time come from the cached message index, only
+    # the two wind messages are read and decoded
     import pygrib
     import datetime
     import numpy as np
+    from gribcheck import gribindex, gribread
+    
+    idx = gribindex(fgr)
+    try:
+        eu, ev = idx['UGRD10m'], idx['VGRD10m']
+    except KeyError:
+        return gribdecode_scan(fgr)
+    if eu['unit'] != 1:
+        # forecast time not in hours
+        return gribdecode_scan(fgr)
+    
+    step = eu['ftime']
+    dtni = datetime.datetime.strptime(eu['refdate'], '%Y%m%d%H%M%S') + datetime.timedelta(hours = step)
+    g = pygrib.fromstring(gribread(fgr, eu))
+    grid = gribgrid(g)
+    u = np.flip(g['values'],0)
+    v = np.flip(pygrib.fromstring(gribread(fgr, ev))['values'],0)
+    
+    return dtni, step, u, v, grid
+
+def gribdecode_scan(fgr):
+    import pygrib
+    import datetime
+    import numpy as np
+    
+    grbs = pygrib.open(fgr)
+    try:
+        g = grbs[1]
+        step = g['endStep']
+        dtni = g.analDate + datetime.timedelta(hours = step)
+        
+        g_sel = grbs.select(shortName = '10u')
+        grid = gribgrid(g_sel[0])
+        u = np.flip(g_sel[0]['values'],0)
+        
+        g_sel = grbs.select(shortName = '10v')
+        v = np.flip(g_sel[0]['values'],0)
+    finally:
+        grbs.close()
+    
+    return dtni, step, u, v, grid
+
+def gribgrid(g):
+    # regular lat-lon grid of a message, latitudes south to north as after the flip
+    lat0 = min(g['latitudeOfFirstGridPointInDegrees'], g['latitudeOfLastGridPointInDegrees'])
+    return {'lon0': g['longitudeOfFirstGridPointInDegrees'],
+            'dlon': g['iDirectionIncrementInDegrees'],
+            'nx': g['Ni'],
+            'lat0': lat0,
+            'dlat': g['jDirectionIncrementInDegrees'],
+            'ny': g['Nj']}
+
+def subsetindex(grid, bbox=None, stride=1):
+    # column and row indices of the bounding box (leftlon, rightlon,
+    # bottomlat, toplat) thinned by stride; longitudes wrap around the globe
+    import numpy as np
+    
+    eps = 1e-6
+    if bbox is None:
+        ix = np.arange(0, grid['nx'], stride)
+        jy = np.arange(0, grid['ny'], stride)
+        return ix, jy
+    
+    lon0, lon1, lat0, lat1 = bbox
+    # same box on the longitudes of the grid, e.g. -20..20 on a NOMADS
+    # subregion starting at 340 becomes 340..380
+    width = lon1 - lon0 if lon1 > lon0 else lon1 - lon0 + 360
+    lon0 = grid['lon0'] + (lon0 - grid['lon0']) % 360
+    lon1 = lon0 + width
+    i0 = int(np.ceil((lon0 - grid['lon0'])/grid['dlon'] - eps))
+    i1 = int(np.floor((lon1 - grid['lon0'])/grid['dlon'] + eps))
+    nlon = int(round(360./grid['dlon']))
+    if grid['nx'] == nlon:
+        # global grid, lon1 = lon0 + 360 would repeat the first column
+        ix = np.arange(i0, min(i1, i0 + nlon - 1) + 1, stride) % nlon
+    else:
+        ix = np.arange(max(i0, 0), min(i1, grid['nx'] - 1) + 1, stride)
+    j0 = int(np.ceil((lat0 - grid['lat0'])/grid['dlat'] - eps))
+    j1 = int(np.floor((lat1 - grid['lat0'])/grid['dlat'] + eps))
+    jy = np.arange(max(j0, 0), min(j1, grid['ny'] - 1) + 1, stride)
+    if not len(ix) or not len(jy):
+        raise ValueError(f'Bounding box {bbox} outside the grib grid')
+    return ix, jy
+
+def subsetgrid(grid, bbox=None, stride=1):
+    # ww3_prep 'LL' header of the subset : lon first, lon last, nx, lat first, lat last, ny
+    ix, jy = subsetindex(grid, bbox, stride)
+    lonf = grid['lon0'] + ix[0]*grid['dlon']
+    latf = grid['lat0'] + jy[0]*grid['dlat']
+    return (lonf, lonf + (len(ix)-1)*stride*grid['dlon'], len(ix),
+            latf, latf + (len(jy)-1)*stride*grid['dlat'], len(jy))
+
+def subset(a, grid, bbox=None, stride=1):
+    import numpy as np
+    
+    if bbox is None and stride == 1:
+        return a
+    ix, jy = subsetindex(grid, bbox, stride)
+    return a[np.ix_(jy, ix)]
+
+def fieldtext(a):
+    # Rows of '%.2f' separated by blanks, identical to formatting every value.
+    # Values are mapped to integer hundredths and looked up in a table of
+    # preformatted strings; only exact rounding ties and negative zeros, where
+    # the lookup could differ from '%.2f', are formatted one by one.
+    import numpy as np
+    
+    k = np.rint(a*100.)
+    lo, hi = k.min(), k.max()
+    if not (np.isfinite(lo) and np.isfinite(hi)) or hi - lo > maxtable:
+        form = ' '.join(['%.2f']*a.shape[1]) + '\n'
+        return (form*a.shape[0]) % tuple(a.ravel().tolist())
     
+    lo = int(lo)
+    table = np.array(['%.2f' % (i/100.) for i in range(lo, int(hi)+1)], dtype=object)
+    txt = table[k.astype(np.int64) - lo]
+    
+    frac = np.abs(a*100. - np.floor(a*100.) - 0.5)
+    fix = (frac < 1e-6) | ((k == 0) & np.signbit(a))
+    if fix.any():
+        txt[fix] = ['%.2f' % x for x in a[fix].tolist()]
+    
+    return '\n'.join([' '.join(row) for row in txt.tolist()]) + '\n'
+
+def recordtext(dtni, u, v):
+    return dtni.strftime('%Y%m%d %H%M%S') + '\n' + fieldtext(u) + fieldtext(v)
+
+def fortranrecord(a):
+    # sequential unformatted record, 4-byte length markers, native byte order
+    data = a.tobytes()
+    mark = struct.pack('=i', len(data))
+    return mark + data + mark
+
+def recordbin(dtni, u, v):
+    # what ww3_prep reads with IDFM=3 : TIME(2) then one record per component,
+    # ((A(IX,IY),IX=1,NX),IY=1,NY) in default REAL
+    import numpy as np
+    
+    time = np.array([int(dtni.strftime('%Y%m%d')), int(dtni.strftime('%H%M%S'))], dtype='=i4')
+    return (fortranrecord(time) +
+            fortranrecord(np.ascontiguousarray(u, dtype='=f4')) +
+            fortranrecord(np.ascontiguousarray(v, dtype='=f4')))
+
+def recordbytes(dtni, u, v, fmt='txt'):
+    if fmt == 'bin':
+        return recordbin(dtni, u, v)
+    return recordtext(dtni, u, v).encode()
+
+def setprepinp(finp, fmt='txt', datafile=None, grid=None):
+    # point the 'NAME' data-file entry of ww3_prep.inp at the chosen format,
+    # and with grid = (lon first, lon last, nx, lat first, lat last, ny) set
+    # the 'LL' grid range line to the forcing written by grib2ww3
+    line, defname = prepname[fmt]
+    if datafile is None:
+        datafile = defname
+    with open(finp) as f:
+        lines = f.read().split('\n')
+    if grid is not None:
+        for i, l in enumerate(lines):
+            if l.split()[:2] == ["'WND'", "'LL'"]:
+                break
+        else:
+            raise ValueError(f"No 'WND' 'LL' field entry in {finp}")
+        for j in range(i+1, len(lines)):
+            if lines[j].strip() and not lines[j].lstrip().startswith('$'):
+                lonf, lonl, nx, latf, latl, ny = grid
+                lines[j] = f'    {lonf:g} {lonl:g} {nx} {latf:g} {latl:g} {ny}'
+                break
+    for i, l in enumerate(lines):
+        if l.strip().startswith("'NAME'"):
+            unit = lines[i+1].split()[0]
+            lines[i] = line
+            lines[i+1] = f"  {unit} '{datafile}'"
+            break
+    else:
+        raise ValueError(f'No NAME data-file entry in {finp}')
+    with open(finp, 'w') as f:
+        f.write('\n'.join(lines))
+
+def writefdt(fout, dt0):
+    if dt0 is None:
+        # every hour was skipped, there is no first forcing time to record
+        raise ValueError(f'Error: no valid GRIB file converted to {fout}, CONVERSION FAILED!')
     outf, outnamei = os.path.split(fout)
     outname, extt = os.path.splitext(outnamei)
     fouti = os.path.join(outf,'%s.fdt' % outname)
+    
+    # if not os.path.exists(fouti):
+    #     subprocess.run(f"touch {fouti}")
+        
+    with open(fouti,'w') as fo:
+        fo.write(dt0.strftime('%Y%m%d%H'))
+
+def manifestsum(man, fgr):
+    import manifest
+    
+    name = os.path.basename(fgr)
+    for fct, rec in man['hours'].items():
+        if rec['file'] == name and manifest.isverified(man, fct, fgr):
+            return rec['sha256']
+    return None
+
+def gribkey(fgr):
+    # sha256 of the GRIB file, taken from the download manifest when it has
+    # already verified this exact file
+    import manifest
+    
+    outd = os.path.dirname(fgr)
+    key = manifestsum(_manifests[outd], fgr) if outd in _manifests else None
+    if key is None:
+        # verified since the last load, e.g. by the downloader of the pipeline
+        _manifests[outd] = manifest.loadmanifest(outd)
+        key = manifestsum(_manifests[outd], fgr)
+    return key or manifest.filesum(fgr)
+
+def recordtag(fmt='txt', bbox=None, stride=1):
+    # everything besides the GRIB content that changes the converted record
+    tag = fmt
+    if bbox is not None:
+        tag += '-' + '_'.join(f'{x:g}' for x in bbox)
+    if stride != 1:
+        tag += f'-s{stride}'
+    return tag
+
+def cacheget(cachedir, key):
+    fmeta = os.path.join(cachedir, key + '.json')
+    fdata = os.path.join(cachedir, key)
+    try:
+        with open(fmeta) as f:
+            meta = json.load(f)
+        with open(fdata, 'rb') as f:
+            block = f.read()
+    except (FileNotFoundError, ValueError):
+        return None
+    if len(block) != meta['size'] or 'grid' not in meta:
+        return None
+    os.utime(fmeta)
+    os.utime(fdata)
+    dtni = datetime.datetime.strptime(meta['date'], '%Y%m%d%H%M%S')
+    return dtni, meta['step'], block, tuple(meta['grid'])
+
+def cacheput(cachedir, key, res):
+    # data first, the meta file marks the entry complete
+    dtni, step, block, hdr = res
+    os.makedirs(cachedir, exist_ok=True)
+    fdata = os.path.join(cachedir, key)
+    with open(fdata + '.tmp', 'wb') as f:
+        f.write(block)
+    os.replace(fdata + '.tmp', fdata)
+    meta = {'date': dtni.strftime('%Y%m%d%H%M%S'), 'step': step, 'size': len(block),
+            'grid': list(hdr)}
+    with open(fdata + '.json.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(fdata + '.json.tmp', fdata + '.json')
+
+def cacheprune(cachedir, days=cachedays):
+    if not os.path.isdir(cachedir):
+        # nothing was ever cached, e.g. every input file was invalid
+        return
+    tlim = time.time() - days*86400
+    for name in os.listdir(cachedir):
+        fname = os.path.join(cachedir, name)
+        if os.path.getmtime(fname) < tlim:
+            os.remove(fname)
+
+def gribheader(fgr, bbox=None, stride=1):
+    # 'LL' header of the converted grid, from the 10u message header only
+    import pygrib
+    from gribcheck import gribindex, gribread
+    
+    g = pygrib.fromstring(gribread(fgr, gribindex(fgr)['UGRD10m']))
+    return subsetgrid(gribgrid(g), bbox, stride)
+
+def gribblock(fgr, fmt='txt', cachedir=None, bbox=None, stride=1, raw=False, slot=None):
+    # decode and format one forecast hour, runs in a worker process when nproc > 1.
+    # With a cachedir the record is looked up by GRIB checksum first and only
+    # converted when that content has not been converted before.
+    # raw=True returns the subset (u, v) arrays in place of the formatted block.
+    # slot=(fcube, it) also stores the decoded winds in slot it of a wind cube.
+    try:
+        if cachedir and not raw:
+            key = f'{gribkey(fgr)}.{recordtag(fmt, bbox, stride)}'
+            # the cube needs the decoded winds, a cached record has none
+            res = cacheget(cachedir, key) if slot is None else None
+            if res is not None:
+                return res
+        dtni, step, u, v, grid = gribdecode(fgr)
+        u = subset(u, grid, bbox, stride)
+        v = subset(v, grid, bbox, stride)
+        hdr = subsetgrid(grid, bbox, stride)
+    except Exception:
+        return None
+    if slot is not None:
+        # outside the try, a failing cube write is not an invalid GRIB file
+        windcube.cubeput(slot[0], slot[1], u, v)
+    if raw:
+        return dtni, step, (u, v), hdr
+    res = dtni, step, recordbytes(dtni, u, v, fmt), hdr
+    if cachedir and not raw:
+        try:
+            cacheput(cachedir, key, res)
+        except OSError as e:
+            # the cache only saves work, a full or read-only disk must not stop the conversion
+            print(f'Warning, cannot cache {fgr} ({e})')
+    return res
+
+def gribfiles(fgrdir):
+    for root, dirs, files in os.walk(fgrdir, topdown=False):
+        for name in sorted(files):
+            if name.endswith(('.part', '.json', '.tmp', '.gidx')):
+                # partial downloads, the download manifest and message indexes
+                continue
+            yield os.path.join(root,name)
+
+def gribblocks(files, fmt='txt', nproc=1, cachedir=None, bbox=None, stride=1, raw=False, cube=None):
+    # Yield (fgr, gribblock result) in file order. With nproc > 1 the files
+    # are decoded and formatted in worker processes while the caller writes,
+    # at most 2*nproc blocks are held in memory at once. With a cube the
+    # n-th file fills slot n.
+    def slot(i):
+        return None if cube is None else (cube, i)
+    
+    if nproc <= 1:
+        for i, fgr in enumerate(files):
+            yield fgr, gribblock(fgr, fmt, cachedir, bbox, stride, raw, slot(i))
+        return
+    
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+    
+    inflight = deque()
+    with ProcessPoolExecutor(max_workers=nproc) as pool:
+        try:
+            for i, fgr in enumerate(files):
+                inflight.append((fgr, pool.submit(gribblock, fgr, fmt, cachedir, bbox, stride, raw, slot(i))))
+                if len(inflight) >= 2*nproc:
+                    fgr, fut = inflight.popleft()
+                    yield fgr, fut.result()
+            while inflight:
+                fgr, fut = inflight.popleft()
+                yield fgr, fut.result()
+        finally:
+            for fgr, fut in inflight:
+                fut.cancel()
+
+def retimer(dt):
+    # push(dtni, u, v) returns the records due every dt hours from the first
+    # pushed time up to dtni, linear in time between consecutive pushes.
+    # Targets that fall on a pushed time are passed through unchanged, so a
+    # dt that is a multiple of the input spacing only thins the records.
+    import datetime
+    
+    state = {}
+    def push(dtni, u, v):
+        if not state:
+            state.update(t=dtni, u=u, v=v, nxt=dtni)
+        t0, u0, v0, tn = state['t'], state['u'], state['v'], state['nxt']
+        span = (dtni - t0).total_seconds()
+        out = []
+        while tn <= dtni:
+            w = (tn - t0).total_seconds()/span if span else 0.
+            if w == 0.:
+                out.append((tn, u0, v0))
+            elif w == 1.:
+                out.append((tn, u, v))
+            else:
+                out.append((tn, u0 + w*(u - u0), v0 + w*(v - v0)))
+            tn += datetime.timedelta(hours = dt)
+        state.update(t=dtni, u=u, v=v, nxt=tn)
+        return out
+    return push
+
+def cubeinit(cube, files, nt, bbox=None, stride=1):
+    # create the wind cube from the grid of the first readable file
+    for fgr in files:
+        try:
+            return windcube.cubecreate(cube, nt, gribheader(fgr, bbox, stride))
+        except Exception:
+            continue
+    raise ValueError('Error: no readable grib file to size the wind cube')
+
+def runqc(cube, scratch=False):
+    # a rejected scratch cube is kept for inspection, the next run overwrites it
+    import windqc
+    
+    stats, problems = windqc.cubeqc(cube)
+    if problems or not stats:
+        raise RuntimeError(f'Error: wind QC failed with {len(problems)} problems, FORCING REJECTED!')
+    if scratch:
+        os.remove(cube)
+
+def grib2ww3(fgrdir,fout,maxt = 240,fmt = 'txt',nproc = 1,cachedir = None,
+             bbox = None,stride = 1,prep_inp = None,dt = None,cube = None,qc = False):
+    # dt : output interval [h], records are thinned or interpolated in time
+    # cube : wind cube file filled with the decoded (subset) winds
+    # qc : check the decoded winds before the run is marked complete, through
+    #      cube or else a scratch <fout>.cube deleted when the check passes
+    scratch = qc and not cube
+    if scratch:
+        cube = fout + '.cube'
     dt0 = None
+    hdr0 = None
+    push = retimer(dt) if dt else None
     
     try:
         os.remove(fout)
     except:
         pass
     
-    for root, dirs, files in os.walk(fgrdir, topdown=False):
-        for name in sorted(files):
-            fgr = os.path.join(root,name)
-            print(f'Processing file: {fgr}')
-            try:
-                grbs = pygrib.open(fgr)
-                g = grbs[1]
-                dtni = g.analDate + datetime.timedelta(hours = g['endStep'])
-                if g['endStep'] > maxt:
-                    break
+    files = list(gribfiles(fgrdir))
+    if cube:
+        cubeinit(cube, files, len(files), bbox, stride)
+    
+    fo = open(fout, 'wb', buffering=bufsize)
+    blocks = gribblocks(files, fmt, nproc, cachedir, bbox, stride, raw = bool(dt), cube = cube)
+    for it, (fgr, res) in enumerate(blocks):
+        print(f'Processing file: {fgr}')
+        if res is None:
+            print(f'Warning, invalid file {fgr} : Skip')
+            continue
+        dtni, step, block, hdr = res
+        if step > maxt:
+            break
+        if cube:
+            windcube.cubemark(cube, it, dtni)
+        if not dt0:
+            dt0 = dtni
+            hdr0 = hdr
+        if hdr != hdr0:
+            raise ValueError(f'Error: grid of {fgr} {hdr} differs from {hdr0}')
+        
+        if push:
+            for t, u, v in push(dtni, *block):
+                fo.write(recordbytes(t, u, v, fmt))
+        else:
+            fo.write(block)
+    fo.close()
+    
+    if qc:
+        runqc(cube, scratch)
+    writefdt(fout, dt0)
+    if prep_inp is not None:
+        setprepinp(prep_inp, fmt, grid=hdr0)
+    if cachedir:
+        cacheprune(cachedir)
+
+def grib2ww3_pipeline(grib_dir,dts,fout,maxt = 240,fmt = 'txt',nproc = 1,cachedir = None,
+                      bbox = None,stride = 1,prep_inp = None,dt = None,cadence = None,
+                      cube = None,qc = False):
+    # Download and conversion overlap: the downloader runs in a thread and
+    # queues every verified forecast hour, the converter appends them to fout
+    # strictly in time order as soon as the next expected hour is available.
+    # With nproc > 1 each hour is handed to a worker process on arrival, at
+    # most 2*nproc at once, earliest hours first.
+    import queue
+    import threading
+    from gfs_downloader import main_downloader, fcthours
+    
+    # without a cube of its own the QC fills a scratch one, removed once passed
+    scratch = qc and not cube
+    if scratch:
+        cube = fout + '.cube'
+    q = queue.Queue()
+    failed = []
+    
+    def producer():
+        try:
+            kw = {} if bbox is None else {'bbox': bbox}
+            if cadence is not None:
+                kw['cadence'] = cadence
+            main_downloader(grib_dir,
+                            dts=dts,
+                            maxt=maxt,
+                            onverified=lambda fct, fgr: q.put((fct, fgr)),
+                            **kw)
+        except BaseException as e:
+            failed.append(e)
+        finally:
+            q.put(None)
+    
+    pool = None
+    if nproc > 1:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # workers start on demand, after the downloader thread; forked from
+        # this process they could inherit a lock held by that thread
+        pool = ProcessPoolExecutor(max_workers=nproc, mp_context=multiprocessing.get_context('forkserver'))
+    
+    th = threading.Thread(target=producer, daemon=True)
+    th.start()
+    
+    try:
+        os.remove(fout)
+    except:
+        pass
+    
+    fo = open(fout, 'wb', buffering=bufsize)
+    hours = fcthours(maxt, cadence) if cadence is not None else fcthours(maxt)
+    push = retimer(dt) if dt else None
+    raw = bool(dt)
+    cubeready = []
+    ready = {}
+    nxt = 0
+    dt0 = None
+    hdr0 = None
+    
+    def submit():
+        # earliest waiting hours to the pool, bounded like gribblocks
+        for fct in sorted(ready):
+            if sum(fut is not None for _, _, fut in ready.values()) >= 2*nproc:
+                break
+            fgr, slot, fut = ready[fct]
+            if fut is None:
+                ready[fct] = (fgr, slot, pool.submit(gribblock, fgr, fmt, cachedir, bbox, stride, raw, slot))
+    
+    try:
+        while True:
+            item = q.get()
+            if item is None:
+                break
+            fct, fgr = item
+            slot = None
+            if cube:
+                if not cubeready:
+                    cubeinit(cube, [fgr], len(hours), bbox, stride)
+                    cubeready.append(True)
+                slot = (cube, hours.index(fct))
+            ready[fct] = (fgr, slot, None)
+            if pool:
+                submit()
+            while nxt < len(hours) and hours[nxt] in ready:
+                fgr, slot, fut = ready.pop(hours[nxt])
+                if pool:
+                    submit()
+                print(f'Processing file: {fgr}')
+                res = fut.result() if fut else gribblock(fgr, fmt, cachedir, bbox, stride, raw, slot)
+                it, nxt = nxt, nxt + 1
+                if res is None:
+                    # as in grib2ww3, the hour is left out of the forcing
+                    print(f'Warning, invalid file {fgr} : Skip')
+                    continue
+                dtni, step, block, hdr = res
+                if cube:
+                    windcube.cubemark(cube, it, dtni)
                 if not dt0:
                     dt0 = dtni
-            except:
-                print(f'Warning, invalid file {fgr} : Skip')
-                continue
-            
-            with open(fout,'a') as fo:
-                fo.write(dtni.strftime('%Y%m%d %H%M%S'))
-                fo.write('\n')
-            
-            g_sel = grbs.select(shortName = '10u')
-            g = g_sel[0]
-            u = g['values']
-            u = np.flip(u,0)
-            form = (('%.2f'+' ')*u.shape[1])[:-1]
-            for i in range(u.shape[0]):
-                with open(fout,'a') as fo:
-                    fo.write(form % tuple(u[i,:]))
-                    fo.write('\n')
-                    
-            g_sel = grbs.select(shortName = '10v')
-            g = g_sel[0]
-            v = g['values']
-            v = np.flip(v,0)
-            for i in range(v.shape[0]):
-                with open(fout,'a') as fo:
-                    fo.write(form % tuple(v[i,:]))
-                    fo.write('\n')
+                    hdr0 = hdr
+                if hdr != hdr0:
+                    raise ValueError(f'Error: grid of {fgr} {hdr} differs from {hdr0}')
+                if push:
+                    for t, u, v in push(dtni, *block):
+                        fo.write(recordbytes(t, u, v, fmt))
+                else:
+                    fo.write(block)
+    finally:
+        fo.close()
+        if pool:
+            pool.shutdown(cancel_futures=True)
+    th.join()
     
-    # if not os.path.exists(fouti):
-    #     subprocess.run(f"touch {fouti}")
-        
-    with open(fouti,'w') as fo:
-        fo.write(dt0.strftime('%Y%m%d%H'))
+    if failed:
+        raise failed[0]
+    if nxt < len(hours):
+        raise RuntimeError(f'Error: forecast hour {hours[nxt]} never arrived, CONVERSION INCOMPLETE!')
+    
+    if qc:
+        runqc(cube, scratch)
+    writefdt(fout, dt0)
+    if prep_inp is not None:
+        setprepinp(prep_inp, fmt, grid=hdr0)
+    if cachedir:
+        cacheprune(cachedir)
                     
 if __name__ == '__main__':
     grib_dir = '/mnt/d/bak/gfs/2019050300'
@@ -92,6 +632,46 @@ if __name__ == '__main__':
                         help='Maximum forecast time, format = "t"',
                         default = 240)
     
+    parser.add_argument('-f', action='store', dest='fmt',
+                        choices=['txt', 'bin'],
+                        help='Output format, txt : formatted text, bin : unformatted binary for ww3_prep IDFM=3',
+                        default = 'txt')
+    
+    parser.add_argument('-n', action='store', dest='nproc',
+                        help='Number of worker processes decoding grib files',
+                        default = 1)
+    
+    parser.add_argument('--cache', action='store', dest='cachedir',
+                        help='Directory of converted records keyed by GRIB checksum, only new or changed files are converted',
+                        default = None)
+    
+    parser.add_argument('-b', action='store', dest='bbox',
+                        help='Bounding box, format = "leftlon,rightlon,bottomlat,toplat". Also limits the download in archive mode',
+                        default = None)
+    
+    parser.add_argument('-s', action='store', dest='stride',
+                        help='Keep every s-th grid point in both directions',
+                        default = 1)
+    
+    parser.add_argument('-p', action='store', dest='cadence',
+                        help='Forecast hour cadence downloaded in archive mode, format = "until:step,...,step". Example : 120:1,3',
+                        default = None)
+    
+    parser.add_argument('--dt', action='store', dest='dt',
+                        help='Output interval in hours, forcing is thinned or linearly interpolated in time',
+                        default = None)
+    
+    parser.add_argument('--cube', action='store', dest='cube',
+                        help='Also store the decoded winds in this memory-mapped float32 cube file',
+                        default = None)
+    
+    parser.add_argument('--qc', action='store_true',
+                        help='Check the decoded winds (extremes, NaN, jumps) and fail before ww3_prep on bad forcing')
+    
+    parser.add_argument('--prep_inp', action='store', dest='prep_inp',
+                        help='ww3_prep.inp to update with the NAME entry and grid matching the output',
+                        default = None)
+    
     subparsers = parser.add_subparsers(dest='subcommand',help='Select mode <archive> or <convert>.')
     
     parse_a = subparsers.add_parser('archive',
@@ -100,6 +680,9 @@ if __name__ == '__main__':
     parse_a.add_argument('date',
                          help = 'Forecast date, format = "YYYYMMDDHH"')
     
+    parse_a.add_argument('--pipeline', action='store_true',
+                         help = 'Convert each forecast hour as soon as it is downloaded')
+    
     
     parse_b = subparsers.add_parser('convert',
                                     help='In this mode, download and check will be disabled, and grib directory will be <grib_dir>')
@@ -110,16 +693,51 @@ if __name__ == '__main__':
     
     r = parser.parse_args()
     
+    bbox = None
+    if r.bbox is not None:
+        bbox = tuple(float(x) for x in r.bbox.split(','))
+    dt = float(r.dt) if r.dt is not None else None
+    
+    if r.subcommand == 'archive' and r.pipeline:
+        grib2ww3_pipeline(r.grib_dir,
+                          r.date,
+                          r.output_file,
+                          maxt = int(r.maxt),
+                          fmt = r.fmt,
+                          nproc = int(r.nproc),
+                          cachedir = r.cachedir,
+                          bbox = bbox,
+                          stride = int(r.stride),
+                          prep_inp = r.prep_inp,
+                          dt = dt,
+                          cadence = r.cadence,
+                          cube = r.cube,
+                          qc = r.qc)
+        raise SystemExit(0)
+    
     if r.subcommand == 'archive':
         grib_dir = os.path.join(r.grib_dir,r.date)
         from gfs_downloader import main_downloader
+        kw = {} if bbox is None else {'bbox': bbox}
+        if r.cadence is not None:
+            kw['cadence'] = r.cadence
         main_downloader(r.grib_dir,
                         dts=r.date,
-                        maxt=int(r.maxt))
+                        maxt=int(r.maxt),
+                        **kw)
     else:
         grib_dir = r.grib_dir
     
     grib2ww3(grib_dir,
              r.output_file,
-             maxt = int(r.maxt))
+             maxt = int(r.maxt),
+             fmt = r.fmt,
+             nproc = int(r.nproc),
+             cachedir = r.cachedir,
+             bbox = bbox,
+             stride = int(r.stride),
+             prep_inp = r.prep_inp,
+             dt = dt,
+             cube = r.cube,
+             qc = r.qc)
     
\ No newline at end of file
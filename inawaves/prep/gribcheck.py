@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+GRIB2 completeness checker and message index
+
+Walks the section headers of every message in a GRIB2 file without
+decoding any data, so a whole GFS cycle directory is checked in
+milliseconds and without spawning external tools. The same walk gives a
+byte-offset index, cached next to the file, to jump straight to a message.
+"""
+import os
+import json
+import struct
+import datetime
+
+#%% Global variables
+# name : (discipline, category, number, level type, level value)
+# None matches any level, GRIB2 code table 4.5 : 101 msl, 103 height above ground
+gribparams = {
+    'UGRD10m' : (0, 2, 2, 103, 10.),
+    'VGRD10m' : (0, 2, 3, 103, 10.),
+    'PRMSL'   : (0, 3, 1, 101, None),
+    'DPT'     : (0, 0, 6, None, None),
+}
+# DPT is requested by domsel on the 10 m and msl levels, where GFS does not
+# publish it, so it is reported when present but not required
+gribrequired = ['UGRD10m', 'VGRD10m', 'PRMSL']
+indexsuffix = '.gidx'
+
+#%% Functions
+def _signed(b, n):
+    # GRIB sign-magnitude integer, most significant bit is the sign
+    v = int.from_bytes(b, 'big')
+    sign = 1 << (8*n - 1)
+    return -(v & ~sign) if v & sign else v
+
+def _sec1(buf):
+    year, month, day, hour, minute, second = struct.unpack('>HBBBBB', buf[12:19])
+    return datetime.datetime(year, month, day, hour, minute, second)
+
+def _sec4(buf):
+    template = struct.unpack('>H', buf[7:9])[0]
+    field = {'template': template,
+             'category': buf[9],
+             'number': buf[10]}
+    if template in (0, 1, 8, 11):
+        field['unit'] = buf[17]
+        field['ftime'] = _signed(buf[18:22], 4)
+        field['ltype'] = buf[22]
+        scale = _signed(buf[23:24], 1)
+        scaled = int.from_bytes(buf[24:28], 'big')
+        if buf[23] == 0xff or scaled == 0xffffffff:
+            field['level'] = None
+        else:
+            field['level'] = scaled * 10.**(-scale)
+    return field
+
+def gribname(discipline, field):
+    for name, (dis, cat, num, ltype, level) in gribparams.items():
+        if (dis, cat, num) != (discipline, field['category'], field['number']):
+            continue
+        if ltype is not None and field.get('ltype') != ltype:
+            continue
+        if level is not None and field.get('level') != level:
+            continue
+        return name
+    return None
+
+def gribscan(fgr):
+    """
+    Return one dict per GRIB2 message with its byte offset, length,
+    reference time and decoded product definition (no data section read).
+    Raise ValueError if any message is truncated or malformed.
+    """
+    fsize = os.path.getsize(fgr)
+    msgs = []
+    with open(fgr, 'rb') as f:
+        if fsize < 20:
+            raise ValueError(f'{fgr}: too short for a GRIB2 message')
+        f.seek(-4, 2)
+        if f.read(4) != b'7777':
+            raise ValueError(f'{fgr}: missing end marker 7777')
+
+        offset = 0
+        while offset < fsize:
+            f.seek(offset)
+            sec0 = f.read(16)
+            if len(sec0) < 16 or sec0[:4] != b'GRIB':
+                raise ValueError(f'{fgr}: no GRIB header at byte {offset}')
+            if sec0[7] != 2:
+                raise ValueError(f'{fgr}: GRIB edition {sec0[7]} at byte {offset}')
+            length = struct.unpack('>Q', sec0[8:16])[0]
+            end = offset + length
+            if end > fsize:
+                raise ValueError(f'{fgr}: message at byte {offset} truncated')
+
+            msg = {'offset': offset, 'length': length,
+                   'discipline': sec0[6], 'fields': []}
+            pos = offset + 16
+            while pos < end - 4:
+                f.seek(pos)
+                hdr = f.read(5)
+                seclen, secnum = struct.unpack('>IB', hdr)
+                if seclen < 5 or pos + seclen > end - 4:
+                    raise ValueError(f'{fgr}: bad section {secnum} at byte {pos}')
+                if secnum == 1:
+                    f.seek(pos)
+                    msg['refdate'] = _sec1(f.read(21))
+                elif secnum == 4:
+                    f.seek(pos)
+                    field = _sec4(f.read(min(seclen, 34)))
+                    field['name'] = gribname(msg['discipline'], field)
+                    msg['fields'].append(field)
+                pos += seclen
+
+            f.seek(end - 4)
+            if f.read(4) != b'7777':
+                raise ValueError(f'{fgr}: message at byte {offset} has no end marker')
+            msgs.append(msg)
+            offset = end
+    return msgs
+
+def gribreport(fgr, required=gribrequired):
+    rep = {'file': fgr, 'nmsg': 0, 'names': [], 'missing': list(required), 'error': None}
+    try:
+        msgs = gribscan(fgr)
+    except (OSError, ValueError, struct.error) as e:
+        rep['error'] = str(e)
+        return rep
+    names = [fld['name'] for m in msgs for fld in m['fields'] if fld['name']]
+    rep['nmsg'] = len(msgs)
+    rep['names'] = names
+    rep['missing'] = [n for n in required if n not in names]
+    return rep
+
+def gribvalid(fgr, required=gribrequired):
+    rep = gribreport(fgr, required)
+    return rep['error'] is None and not rep['missing']
+
+def gribindex(fgr, cache=True):
+    """
+    Return {name: {'offset', 'length', 'refdate', 'ftime', 'unit'}} for the
+    named fields of fgr. The index is stored in <fgr>.gidx and reused while
+    the size and mtime of fgr are unchanged.
+    """
+    st = os.stat(fgr)
+    fidx = fgr + indexsuffix
+    if cache:
+        try:
+            with open(fidx) as f:
+                idx = json.load(f)
+            if idx['size'] == st.st_size and idx['mtime'] == st.st_mtime_ns:
+                return idx['fields']
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+
+    fields = {}
+    for msg in gribscan(fgr):
+        for fld in msg['fields']:
+            if fld['name'] and fld['name'] not in fields:
+                fields[fld['name']] = {
+                    'offset': msg['offset'],
+                    'length': msg['length'],
+                    'refdate': msg['refdate'].strftime('%Y%m%d%H%M%S'),
+                    'ftime': fld.get('ftime'),
+                    'unit': fld.get('unit'),
+                }
+
+    if cache:
+        tmp = fidx + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump({'size': st.st_size, 'mtime': st.st_mtime_ns, 'fields': fields}, f)
+            os.replace(tmp, fidx)
+        except OSError:
+            # read-only archive, work from the in-memory index
+            pass
+    return fields
+
+def gribread(fgr, entry):
+    # raw bytes of one indexed message
+    with open(fgr, 'rb') as f:
+        f.seek(entry['offset'])
+        return f.read(entry['length'])
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='GRIB2 completeness checker')
+
+    parser.add_argument('paths', nargs='+',
+                        help = 'GRIB files or cycle directories to check')
+
+    r = parser.parse_args()
+
+    nbad = 0
+    for path in r.paths:
+        if os.path.isdir(path):
+            files = [os.path.join(path, n) for n in sorted(os.listdir(path))
+                     if not n.endswith(('.part', '.json', indexsuffix)) and os.path.isfile(os.path.join(path, n))]
+        else:
+            files = [path]
+        for fgr in files:
+            rep = gribreport(fgr)
+            if rep['error'] or rep['missing']:
+                nbad += 1
+                print(f"{fgr}: FAIL {rep['error'] or 'missing ' + ','.join(rep['missing'])}")
+            else:
+                print(f"{fgr}: OK {rep['nmsg']} messages ({','.join(rep['names'])})")
+    raise SystemExit(1 if nbad else 0)
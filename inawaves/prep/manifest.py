@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Per-cycle download manifest
+
+Keeps <outfol>/<YYYYMMDDHH>/manifest.json with size, mtime, checksum and
+validation status of every forecast hour, so files that were already
+verified are skipped on a re-run by a single stat() instead of a rescan.
+"""
+import os
+import json
+import hashlib
+
+from gribcheck import gribreport
+
+#%% Global variables
+manifestname = 'manifest.json'
+blocksize = 1 << 20
+
+#%% Functions
+def fhour(fct):
+    return str(int(fct)).zfill(3)
+
+def manifestpath(outd):
+    return os.path.join(outd, manifestname)
+
+def loadmanifest(outd, dts=None):
+    try:
+        with open(manifestpath(outd)) as f:
+            man = json.load(f)
+    except (FileNotFoundError, ValueError):
+        man = {'cycle': dts, 'expected': [], 'hours': {}}
+    if dts is not None:
+        man['cycle'] = dts
+    return man
+
+def savemanifest(outd, man):
+    man['missing'] = missinghours(man)
+    os.makedirs(outd, exist_ok=True)
+    tmp = manifestpath(outd) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(man, f, indent=1, sort_keys=True)
+    os.replace(tmp, manifestpath(outd))
+
+def filesum(fname):
+    h = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def isverified(man, fct, fname):
+    # O(1) : trust a previous verification while size and mtime are unchanged
+    rec = man['hours'].get(fhour(fct))
+    if not rec or rec['status'] != 'ok' or rec['file'] != os.path.basename(fname):
+        return False
+    try:
+        st = os.stat(fname)
+    except FileNotFoundError:
+        return False
+    return st.st_size == rec['size'] and st.st_mtime_ns == rec['mtime']
+
+def verify(man, fct, fname, subregion=None):
+    # subregion : NOMADS bounding box the file was requested with, None for the
+    # native global grid; a file fetched for another one has to be fetched again
+    if subregion is not None:
+        subregion = [float(x) for x in subregion]
+    rec = man['hours'].get(fhour(fct))
+    if rec and rec.get('subregion') != subregion:
+        man['hours'].pop(fhour(fct))
+        return False
+    if isverified(man, fct, fname):
+        return True
+    if not os.path.isfile(fname):
+        man['hours'].pop(fhour(fct), None)
+        return False
+    st = os.stat(fname)
+    rep = gribreport(fname)
+    ok = rep['error'] is None and not rep['missing']
+    man['hours'][fhour(fct)] = {
+        'file': os.path.basename(fname),
+        'size': st.st_size,
+        'mtime': st.st_mtime_ns,
+        'sha256': filesum(fname) if ok else None,
+        'nmsg': rep['nmsg'],
+        'subregion': subregion,
+        'status': 'ok' if ok else 'invalid',
+    }
+    return ok
+
+def verifiedhours(man):
+    return sorted(int(k) for k, rec in man['hours'].items() if rec['status'] == 'ok')
+
+def missinghours(man):
+    done = set(verifiedhours(man))
+    return [fct for fct in man['expected'] if fct not in done]
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Show download manifest of a GFS cycle directory')
+
+    parser.add_argument('cycle_directory',
+                        help = 'Cycle directory, <outfol>/<YYYYMMDDHH>')
+
+    r = parser.parse_args()
+
+    man = loadmanifest(r.cycle_directory)
+    print(f"cycle    : {man['cycle']}")
+    print(f"verified : {' '.join(fhour(f) for f in verifiedhours(man))}")
+    print(f"missing  : {' '.join(fhour(f) for f in missinghours(man))}")
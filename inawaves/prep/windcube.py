@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Memory-mapped scratch store of decoded GFS winds
+
+One file per cycle: a single JSON header line describing the grid, the
+layout and the valid time of every slot, padded to a page boundary, then
+a float32 array (time, lat, lon, component) with component = u10, v10.
+grib2ww3 fills it while converting; QC, plots or other writers open it
+with cubeopen and get numpy.memmap views without decoding GRIB again.
+"""
+import json
+import datetime
+import numpy as np
+
+#%% Global variables
+magic = 'W3CUBE1'
+components = ['u10', 'v10']
+pagesize = 4096
+tfmt = '%Y%m%d%H%M%S'
+
+#%% Functions
+def _hdrsize(nt):
+    # room for the fixed keys plus one time string per slot, page aligned
+    need = 1024 + 20*nt
+    return -(-need//pagesize)*pagesize
+
+def cubeheader(fcube):
+    with open(fcube, 'rb') as f:
+        hdr = json.loads(f.readline())
+    if hdr.get('magic') != magic:
+        raise ValueError(f'{fcube} is not a wind cube')
+    return hdr
+
+def _writeheader(fcube, hdr):
+    line = json.dumps(hdr).encode() + b'\n'
+    if len(line) > hdr['offset']:
+        raise ValueError(f'Header of {fcube} does not fit in {hdr["offset"]} bytes')
+    with open(fcube, 'r+b') as f:
+        f.write(line.ljust(hdr['offset'], b' '))
+
+def cubecreate(fcube, nt, grid):
+    """
+    Create an empty cube of nt slots on grid = (lon first, lon last, nx,
+    lat first, lat last, ny), the 'LL' header written by grib2ww3. Rows run
+    south to north as in the forcing file. The data part is sparse until filled.
+    """
+    lonf, lonl, nx, latf, latl, ny = grid
+    offset = _hdrsize(nt)
+    hdr = {
+        'magic': magic,
+        'offset': offset,
+        'dtype': '<f4',
+        'shape': [nt, ny, nx, len(components)],
+        'dims': ['time', 'lat', 'lon', 'component'],
+        'components': components,
+        'grid': [lonf, lonl, nx, latf, latl, ny],
+        'times': [None]*nt,
+    }
+    with open(fcube, 'wb') as f:
+        f.truncate(offset + nt*ny*nx*len(components)*4)
+    _writeheader(fcube, hdr)
+    return hdr
+
+def cubeopen(fcube, mode='r'):
+    # header and a zero-copy memmap of the whole cube
+    hdr = cubeheader(fcube)
+    arr = np.memmap(fcube, dtype=hdr['dtype'], mode=mode,
+                    offset=hdr['offset'], shape=tuple(hdr['shape']))
+    return hdr, arr
+
+def cubeput(fcube, it, u, v):
+    # fill slot it, safe to call from worker processes on distinct slots
+    hdr, arr = cubeopen(fcube, 'r+')
+    arr[it,:,:,0] = u
+    arr[it,:,:,1] = v
+    arr.flush()
+    del arr
+
+def cubemark(fcube, it, dtni):
+    # publish the valid time of a filled slot, done by the single writer process
+    hdr = cubeheader(fcube)
+    hdr['times'][it] = dtni.strftime(tfmt)
+    _writeheader(fcube, hdr)
+
+def cubetimes(hdr):
+    # valid time per slot, None for slots not filled
+    return [datetime.datetime.strptime(t, tfmt) if t else None for t in hdr['times']]
+
+def cubeaxes(hdr):
+    # lat, lon coordinates of the cube grid
+    lonf, lonl, nx, latf, latl, ny = hdr['grid']
+    return np.linspace(latf, latl, ny), np.linspace(lonf, lonl, nx)
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Describe a decoded wind cube')
+
+    parser.add_argument('cube_file',
+                        help = 'Wind cube written by grib2ww3 --cube')
+
+    r = parser.parse_args()
+
+    hdr = cubeheader(r.cube_file)
+    times = [t for t in cubetimes(hdr) if t is not None]
+    print(f"shape  : {' x '.join(str(n) for n in hdr['shape'])} ({','.join(hdr['dims'])})")
+    print(f"grid   : {' '.join(f'{x:g}' for x in hdr['grid'])}")
+    print(f"filled : {len(times)} of {hdr['shape'][0]}")
+    if times:
+        print(f"times  : {times[0]:%Y-%m-%d %H:%M} .. {times[-1]:%Y-%m-%d %H:%M}")
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Quality control of decoded GFS winds
+
+Checks every filled step of a wind cube (see windcube.py) before the
+forcing goes into a WW3 run: extremes, NaNs, constant fields and
+step-to-step jumps against climatological bounds. Statistics are reduced
+over whole time chunks with numpy, there is no loop over grid points.
+"""
+import numpy as np
+
+import windcube
+
+#%% Global variables
+# climatological bounds for 10 m wind [m/s]
+qcbounds = {
+    'compmax' : 100.,   # |u|, |v|
+    'spdmax'  : 95.,    # wind speed, above the strongest observed tropical cyclones
+    'dspdmax' : 60.,    # largest change of speed at one point between consecutive steps
+    'nanmax'  : 0,      # NaN values allowed per step
+}
+chunk = 16              # steps reduced at once
+
+#%% Functions
+def cubestats(fcube, chunk=chunk):
+    """
+    Per-step statistics of the filled slots of fcube : valid time, min/max
+    of u and v, max speed, NaN count, standard deviation of speed and the
+    largest speed change from the previous filled step.
+    """
+    hdr, arr = windcube.cubeopen(fcube)
+    times = windcube.cubetimes(hdr)
+    slots = [i for i, t in enumerate(times) if t is not None]
+
+    stats = []
+    prev = None
+    for k in range(0, len(slots), chunk):
+        idx = slots[k:k+chunk]
+        a = arr[idx]
+        u = a[..., 0].reshape(len(idx), -1)
+        v = a[..., 1].reshape(len(idx), -1)
+        spd = np.hypot(u, v)
+
+        nnan = np.isnan(u).sum(axis=1) + np.isnan(v).sum(axis=1)
+        umin, umax = np.fmin.reduce(u, axis=1), np.fmax.reduce(u, axis=1)
+        vmin, vmax = np.fmin.reduce(v, axis=1), np.fmax.reduce(v, axis=1)
+        smax = np.fmax.reduce(spd, axis=1)
+        sstd = np.nanstd(spd, axis=1) if nnan.any() else spd.std(axis=1)
+
+        full = spd if prev is None else np.concatenate([prev[None], spd])
+        dspd = np.fmax.reduce(np.abs(np.diff(full, axis=0)), axis=1)
+        if prev is None:
+            dspd = np.concatenate([[0.], dspd])
+        prev = spd[-1]
+
+        for j, it in enumerate(idx):
+            stats.append({'slot': it, 'time': times[it],
+                          'umin': float(umin[j]), 'umax': float(umax[j]),
+                          'vmin': float(vmin[j]), 'vmax': float(vmax[j]),
+                          'spdmax': float(smax[j]), 'spdstd': float(sstd[j]),
+                          'dspdmax': float(dspd[j]), 'nnan': int(nnan[j])})
+    del arr
+    return stats
+
+def qcproblems(stats, bounds=qcbounds):
+    problems = []
+    for s in stats:
+        t = s['time'].strftime('%Y%m%d %H%M')
+        if s['nnan'] > bounds['nanmax']:
+            problems.append(f"{t} : {s['nnan']} NaN values")
+        if max(-s['umin'], s['umax'], -s['vmin'], s['vmax']) > bounds['compmax']:
+            problems.append(f"{t} : component out of range u[{s['umin']:.1f},{s['umax']:.1f}] v[{s['vmin']:.1f},{s['vmax']:.1f}]")
+        if s['spdmax'] > bounds['spdmax']:
+            problems.append(f"{t} : wind speed {s['spdmax']:.1f} m/s")
+        if s['spdstd'] == 0:
+            problems.append(f"{t} : constant field")
+        if s['dspdmax'] > bounds['dspdmax']:
+            problems.append(f"{t} : speed jump {s['dspdmax']:.1f} m/s from previous step")
+    return problems
+
+def cubeqc(fcube, bounds=qcbounds, verbose=True):
+    # statistics and problems of a wind cube, prints a compact report
+    stats = cubestats(fcube)
+    problems = qcproblems(stats, bounds)
+    if verbose:
+        if stats:
+            print(f"QC {fcube} : {len(stats)} steps, "
+                  f"u [{min(s['umin'] for s in stats):.1f}, {max(s['umax'] for s in stats):.1f}] "
+                  f"v [{min(s['vmin'] for s in stats):.1f}, {max(s['vmax'] for s in stats):.1f}] "
+                  f"max speed {max(s['spdmax'] for s in stats):.1f} m/s, "
+                  f"max jump {max(s['dspdmax'] for s in stats):.1f} m/s")
+        else:
+            print(f"QC {fcube} : no filled steps")
+        for p in problems:
+            print(f"QC FAIL {p}")
+    return stats, problems
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Quality control of a decoded wind cube')
+
+    parser.add_argument('cube_file',
+                        help = 'Wind cube written by grib2ww3 --cube')
+
+    r = parser.parse_args()
+
+    stats, problems = cubeqc(r.cube_file)
+    raise SystemExit(1 if problems or not stats else 0)
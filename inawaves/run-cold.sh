@@ -116,7 +116,7 @@ logging "-----------------------------------------------------------------------
 logging "                             PREPROCESSING                              "
 logging "------------------------------------------------------------------------"
 
-${PYTHON} -u ${WDIR}/prep/grib2ww3.py -t 384 ${INDATA}/gfs ${INDATA}/gfs/w3g_gfs.txt archive ${NWDAY}${CYCLE} >> $log_file 2>&1
+${PYTHON} -u ${WDIR}/prep/grib2ww3.py -t 384 --qc ${INDATA}/gfs ${INDATA}/gfs/w3g_gfs.txt archive ${NWDAY}${CYCLE} >> $log_file 2>&1
 
 rm -rf ${WDIR}/prep/wind.txt
 rm -rf ${WDIR}/prep/mod_def*
@@ -106,7 +106,7 @@ logging "-----------------------------------------------------------------------
 logging "                             PREPROCESSING                              "
 logging "------------------------------------------------------------------------"
 
-${PYTHON} -u ${WDIR}/prep/grib2ww3.py -t 384 ${INDATA}/gfs ${INDATA}/gfs/w3g_gfs.txt archive ${NWDAY}${CYCLE} >> $log_file 2>&1
+${PYTHON} -u ${WDIR}/prep/grib2ww3.py -t 384 --qc ${INDATA}/gfs ${INDATA}/gfs/w3g_gfs.txt archive ${NWDAY}${CYCLE} --pipeline >> $log_file 2>&1
 
 rm -rf ${WDIR}/prep/wind.txt
 rm -rf ${WDIR}/prep/mod_def*
@@ -236,23 +236,20 @@ fi
 
 logging "PATH           : ${PATH}"
 logging "LD_LIBRARY_PATH: ${LD_LIBRARY_PATH}"
-logging "Run create_grads2.sh"
-srun --ntasks=1 --exclude=drc0 --exclusive ${WDIR}/post/create_grads.sh >> $log_file 2>&1
 
-logging "                        CONVERT GRADS TO NETCDF                         "
+logging "              GRADS, NETCDF AND PLOTTING PIPELINE PER DOMAIN            "
 logging "------------------------------------------------------------------------"
+# hires first, its NetCDF is the one plotted; create_grads.sh, grads2nc.py
+# and plotter.py can still be run one by one. --derived stores wind speed and
+# arrow unit vectors in the hires file so the plot tasks do not recompute them
 cd ${WDIR}/post
-logging "PATH           : ${PATH}"
-logging "LD_LIBRARY_PATH: ${LD_LIBRARY_PATH}"
-srun --ntasks=1 ${PYTHON} ${WDIR}/post/grads2nc.py global --modelcycle ${NWDAY}${CYCLE} >> $log_file 2>&1 &
-srun --ntasks=1 ${PYTHON} ${WDIR}/post/grads2nc.py reg --modelcycle ${NWDAY}${CYCLE} >> $log_file 2>&1 &
-srun --ntasks=1 ${PYTHON} ${WDIR}/post/grads2nc.py hires --modelcycle ${NWDAY}${CYCLE} >> $log_file 2>&1 &
-wait
-
-logging "                               WW3 Plotting                             "
-logging "------------------------------------------------------------------------"
-${PYTHON} ${WDIR}/post/plotter.py inawaves ${NWDAY}${CYCLE}  --out_dir $TMPIMOUT >> $log_file 2>&1
-logging "Successfully running plotter"
+srun --ntasks=1 --exclude=drc0 --exclusive ${PYTHON} -u ${WDIR}/post/postproc.py hires reg global --modelcycle ${NWDAY}${CYCLE} --out_dir $TMPIMOUT --derived >> $log_file 2>&1
+if [ $? -eq 0 ]; then
+    logging "Successfully running plotter"
+else
+    logging "Failed running post-processing pipeline"
+    exit 1
+fi
 
 logging "Moving NC files to $NCOUT ..."
 mv ${WDIR}/post/*nc $NCOUT >> $log_file 2>&1